@@ -19,39 +19,37 @@ trace_init
 start=`date`
 exptid=`date +%b%d-%H:%M`
 
-rootdir=buffersizing-$exptid
+# Pass the rootdir of an interrupted sweep to resume it.
+rootdir=${1:-buffersizing-$exptid}
 plotpath=../util
 iperf=~/iperf-patched/src/iperf
 
 iface=s0-eth1
 
-for run in 1; do
-#for flows_per_host in 1 2 5 10 20 30 40 50 75 100 125 150 175 200 225 250 275 300 325 350 375 400; do
-for flows_per_host in 1 2 5 10 50 100 200 300 400; do
-#for flows_per_host in 1; do
-	dir=$rootdir/nf$flows_per_host-r$run
-  mkdir -p $dir
-
-  #trace_start $dir/mntrace
-	python buffersizing.py --bw-host 1000 \
-		--bw-net 62.5 \
-		--delay 43.5 \
-		--dir $dir \
-		--nflows $flows_per_host \
-		-n 3 \
-		--iperf $iperf
-  #trace_stop $dir/mntrace
-  #grep mn_ $dir/mntrace >  $dir/mntrace_trimmed
-
-
-# was:		--use-bridge
-
-	python $plotpath/plot_queue.py -f $dir/qlen_$iface.txt -o $dir/q.png
-	python $plotpath/plot_tcpprobe.py -f $dir/tcp_probe.txt -o $dir/cwnd.png --histogram
-done
+# Runs as many configurations at once as there are CPUs for.
+#flows="1,2,5,10,20,30,40,50,75,100,125,150,175,200,225,250,275,300,325,350,375,400"
+flows="1,2,5,10,50,100,200,300,400"
+python sweep.py --dir $rootdir \
+	--flows $flows \
+	--runs 1 \
+	--bw-host 1000 \
+	--bw-net 62.5 \
+	--delay 43.5 \
+	-n 3 \
+	--iperf $iperf
+
+# Only the per-point directories (not --warm's shared warm-*), and
+# only those that finished.
+for dir in $rootdir/nf*/; do
+	if [ ! -s $dir/result.txt ]; then
+		continue
+	fi
+	python $plotpath/plot_queue.py -f $dir/qlen_*$iface.txt -o $dir/q.png
+	if [ -s $dir/tcp_probe.txt ]; then
+		python $plotpath/plot_tcpprobe.py -f $dir/tcp_probe.txt -o $dir/cwnd.png --histogram
+	fi
 done
 
-cat $rootdir/*/result.txt | sort -n -k 1
 python plot-results.py --dir $rootdir -o $rootdir/result.png
 echo "Started at" $start
 echo "Ended at" `date`
@@ -3,13 +3,13 @@
 "CS244 Assignment 2: Buffer Sizing"
 
 from mininet.topo import Topo
-from mininet.node import CPULimitedHost
+from mininet.node import CPULimitedHost, Controller
 from mininet.link import TCLink
 from mininet.net import Mininet
 from mininet.log import lg
-from mininet.util import dumpNodeConnections
+from mininet.util import dumpNodeConnections, custom
 
-from subprocess import Popen, PIPE
+from subprocess import Popen
 from time import sleep, time
 from multiprocessing import Process
 import termcolor as T
@@ -17,11 +17,17 @@ from argparse import ArgumentParser
 
 import sys
 import os
+import io
+import math
 
 sys.path.append('..')
 
+from util.clock import monotonic
 from util.monitor import monitor_qlen
+from util.netdev import ProcNetDev
+from util.qdisc import QdiscSampler, ifindex
 from util.helper import stdev
+import results
 
 
 # Number of samples to skip for reference util calibration.
@@ -49,6 +55,36 @@ SAMPLE_PERIOD_SEC = 1.0
 # Time to wait for first sample, in seconds, as a float.
 SAMPLE_WAIT_SEC = 3.0
 
+# Each queue size the sweep tries is sampled, SEQ_SAMPLE_SEC at a time,
+# once the queue has drained to its new limit (polled every
+# DRAIN_POLL_SEC, for at most SAMPLE_WAIT_SEC) and then SEQ_WAIT_SEC
+# more for TCP to settle, until the t band of its utilisation is clear
+# of the target: at least SEQ_MIN_SAMPLES samples (counting those of
+# queue sizes within NEIGHBOUR_FRACTION of it), and at most
+# SEQ_MAX_SAMPLES of its own.
+# This is a heuristic stopping rule, not a statistical test: the band
+# is rechecked after every sample, consecutive samples are correlated,
+# and neighbours' samples are pooled in, so it is narrower than a real
+# 95% confidence interval would be.
+SEQ_SAMPLE_SEC = 0.5
+SEQ_WAIT_SEC = 1.0
+SEQ_MIN_SAMPLES = 3
+SEQ_MAX_SAMPLES = 8
+DRAIN_POLL_SEC = 0.01
+NEIGHBOUR_FRACTION = 0.05
+
+# Time to let the queue drain between runs on the same network.
+DRAIN_SEC = 1.0
+
+# How long to wait for all the flows to connect, and how often to look.
+CONNECT_TIMEOUT_SEC = 300
+CONNECT_POLL_SEC = 0.05
+
+# Two-sided 95% critical values of Student's t, by degrees of freedom,
+# which set the width of the band.
+T_95 = [None, 12.71, 4.30, 3.18, 2.78, 2.57, 2.45, 2.36, 2.31, 2.26, 2.23,
+        2.20, 2.18, 2.16, 2.14, 2.13, 2.12, 2.11, 2.10, 2.09, 2.09]
+
 
 def cprint(s, color, cr=True):
     """Print in color
@@ -100,10 +136,18 @@ parser.add_argument('-n',
 parser.add_argument('--nflows',
                     dest="nflows",
                     action="store",
-                    type=int,
-                    help="Number of flows per host (for TCP)",
+                    type=lambda s: map(int, s.split(',')),
+                    help="Number of flows per host (for TCP).  A comma-"
+                    "separated list runs each in turn, on the same network",
                     required=True)
 
+parser.add_argument('--point-dir',
+                    dest="point_dir",
+                    help="Directory for the outputs of each number of flows, "
+                    "with %%(dir)s and %%(nflows)d substituted (default: "
+                    "DIR, or DIR/nfNFLOWS for a list of them)",
+                    default=None)
+
 parser.add_argument('--maxq',
                     dest="maxq",
                     action="store",
@@ -126,6 +170,41 @@ parser.add_argument('--iperf',
                     help="Path to custom iperf",
                     required=True)
 
+parser.add_argument('--results',
+                    dest="results",
+                    help="SQLite database to add the results to (see results.py)",
+                    default=None)
+
+parser.add_argument('--run',
+                    dest="run",
+                    type=int,
+                    help="Run number, for --results",
+                    default=1)
+
+# So that several experiments can run at once (see sweep.py)
+parser.add_argument('--prefix',
+                    dest="prefix",
+                    help="Letters to prepend to node (and so interface) names",
+                    default='')
+
+parser.add_argument('--port',
+                    dest="port",
+                    type=int,
+                    help="Controller port",
+                    default=6633)
+
+parser.add_argument('--cpus',
+                    dest="cpus",
+                    help="Comma-separated CPUs to pin hosts to "
+                    "(default: all, round-robin)",
+                    default=None)
+
+parser.add_argument('--no-tcpprobe',
+                    dest="tcpprobe",
+                    action="store_false",
+                    help="Don't log tcp_probe (a single, system-wide log)",
+                    default=True)
+
 # Expt parameters
 args = parser.parse_args()
 
@@ -142,7 +221,7 @@ class StarTopo(Topo):
     "Star topology for Buffer Sizing experiment"
 
     def __init__(self, n=3, cpu=None, bw_host=None, bw_net=None,
-                 delay=None, maxq=None):
+                 delay=None, maxq=None, prefix='', cores=None):
         # Add default members to class.
         super(StarTopo, self ).__init__()
 
@@ -150,15 +229,19 @@ class StarTopo(Topo):
 
         # Create switch and host nodes
         for i in xrange(n):
-            self.add_node( 'h%d' % (i+1), cpu=cpu )
+            opts = dict(cpu=cpu)
+            if cores:
+                opts['cores'] = cores[i % len(cores)]
+            self.add_node( prefix + 'h%d' % (i+1), **opts )
 
-        self.add_switch('s0', fail_mode='open')
+        s0 = prefix + 's0'
+        self.add_switch(s0, fail_mode='open')
 
-        self.add_link('h1', 's0', bw=bw_net,
+        self.add_link(prefix + 'h1', s0, bw=bw_net,
                       max_queue_size=maxq )
 
         for i in xrange(1, n):
-            self.add_link('h%d' % (i+1), 's0',
+            self.add_link(prefix + 'h%d' % (i+1), s0,
                           bw=bw_host, delay=delay )
 
 ############## End: Delete Code ###############
@@ -167,15 +250,49 @@ class StarTopo(Topo):
 def start_tcpprobe():
     "Instal tcp_pobe module and dump to file"
     os.system("rmmod tcp_probe; modprobe tcp_probe;")
-    Popen("cat /proc/net/tcpprobe > %s/tcp_probe.txt" %
-          args.dir, shell=True)
-
-def count_connections():
-    "Count current connections in iperf output file"
-    out = args.dir + "/iperf_server.txt"
-    lines = Popen("grep connected %s | wc -l" % out,
-                  shell=True, stdout=PIPE).communicate()[0]
-    return int(lines)
+    return Popen(["cat", "/proc/net/tcpprobe"],
+                 stdout=open("%s/tcp_probe.txt" % args.dir, "w"))
+
+class ConnectionLog:
+    """Counts the connections logged in the iperf server's output,
+       reading only what has been written since the last count."""
+    def __init__(self, fname):
+        self.fname = fname
+        self.f = None
+        self.partial = ''
+        self.connected = 0
+
+    def count(self):
+        "Returns the number of connections logged so far."
+        if self.f is None:
+            try:
+                self.f = io.FileIO(self.fname, 'r')
+            except IOError:
+                return 0
+        if os.fstat(self.f.fileno()).st_size < self.f.tell():
+            # Truncated (the server was started after we opened it)
+            self.f.seek(0)
+            self.partial = ''
+            self.connected = 0
+        lines = (self.partial + self.f.readall()).split('\n')
+        self.partial = lines.pop()
+        self.connected += sum(1 for l in lines if 'connected' in l)
+        return self.connected
+
+    def wait(self, target, timeout=CONNECT_TIMEOUT_SEC):
+        """Waits until target connections have been logged, or for
+           timeout seconds.  Returns the number logged."""
+        deadline = monotonic() + timeout
+        last = None
+        while True:
+            n = self.count()
+            if n != last:
+                print 'Connections %d/%d  \r' % (n, target),
+                sys.stdout.flush()
+                last = n
+            if n >= target or monotonic() >= deadline:
+                return n
+            sleep(CONNECT_POLL_SEC)
 
 def set_q(iface, q):
     "Change queue size limit of interface"
@@ -189,21 +306,32 @@ def set_speed(iface, spd):
            "htb rate %s burst 15k" % (iface, spd))
     os.system(cmd)
 
+# Kept open across calls to get_txbytes().
+netdev = None
+
 def get_txbytes(iface):
-    f = open('/proc/net/dev', 'r')
-    lines = f.readlines()
-    for line in lines:
-        if iface in line:
-            break
-    f.close()
-    if not line:
-        raise Exception("could not find iface %s in /proc/net/dev:%s" %
-                        (iface, lines))
-    # Extract TX bytes from:
-    #Inter-|   Receive                                                |  Transmit
-    # face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
-    # lo: 6175728   53444    0    0    0     0          0         0  6175728   53444    0    0    0     0       0          0
-    return float(line.split()[9])
+    global netdev
+    if netdev is None:
+        netdev = ProcNetDev()
+    return float(netdev.read([iface])[iface].tx_bytes)
+
+# Kept open across calls to get_qlen().
+qdiscs = None
+
+def get_qlen(iface):
+    "Packets queued in the netem qdisc (the second one listed) of iface"
+    global qdiscs
+    if qdiscs is None:
+        qdiscs = QdiscSampler()
+    stats = qdiscs.sample([ifindex(iface)])
+    return stats[1].qlen if len(stats) > 1 else 0
+
+def wait_drain(iface, q, timeout=SAMPLE_WAIT_SEC):
+    """Wait until the queue of iface is down to q packets, as it is
+       not cut when its limit is lowered, or for timeout seconds."""
+    deadline = monotonic() + timeout
+    while get_qlen(iface) > q and monotonic() < deadline:
+        sleep(DRAIN_POLL_SEC)
 
 def get_rates(iface, nsamples=NSAMPLES, period=SAMPLE_PERIOD_SEC,
               wait=SAMPLE_WAIT_SEC):
@@ -253,6 +381,47 @@ def median(l):
         upper = s[len(l) / 2]
         return float(lower + upper) / 2
 
+def mean_band(lst):
+    """Mean of list and half-width of its t band (what would be its 95%
+       confidence interval, were the samples independent and their
+       number fixed in advance)"""
+    n = len(lst)
+    mean = sum(lst) / n
+    if n < 2:
+        return mean, float('inf')
+    var = sum([(e - mean) ** 2 for e in lst]) / (n - 1)
+    t = T_95[n - 1] if n - 1 < len(T_95) else 1.96
+    return mean, t * math.sqrt(var / n)
+
+def test_q(iface, q, reference_rate, samples):
+    """Heuristic sequential check of whether queue size q meets the
+       target utilisation: sample it until the t band of the mean
+       utilisation is above or below the target, or SEQ_MAX_SAMPLES
+       have been taken (when the mean decides).
+       samples maps each queue size tried so far to its utilisation
+       samples; those within NEIGHBOUR_FRACTION of q are pooled with
+       q's own.  Returns (mean, half-width of its band)."""
+    set_q(iface, q)
+    wait_drain(iface, q)
+    sleep(SEQ_WAIT_SEC)
+    own = samples.setdefault(q, [])
+    last_txbytes, last_time = get_txbytes(iface), monotonic()
+    while True:
+        pooled = [f for k in samples if abs(k - q) <= NEIGHBOUR_FRACTION * q
+                  for f in samples[k]]
+        if own and len(pooled) >= SEQ_MIN_SAMPLES:
+            mean, half = mean_band(pooled)
+            if (mean - half >= args.target or mean + half < args.target or
+                len(own) >= SEQ_MAX_SAMPLES):
+                return mean, half
+        sleep(SEQ_SAMPLE_SEC)
+        txbytes, now = get_txbytes(iface), monotonic()
+        rate = (txbytes - last_txbytes) * 8.0 / 1e6 / (now - last_time)
+        own.append(rate / reference_rate)
+        last_txbytes, last_time = txbytes, now
+        print '.',
+        sys.stdout.flush()
+
 def format_floats(lst):
     "Format list of floats to three decimal places"
     return ', '.join(['%.3f' % f for f in lst])
@@ -267,35 +436,38 @@ def format_fraction(fraction):
         return T.colored('%.3f' % fraction, 'green')
     return T.colored('%.3f' % fraction, 'red', attrs=["bold"])
 
-def do_sweep(iface):
+def do_sweep(iface, nflows, dir, connections, connected=0):
     """Sweep queue length until we hit target utilization.
        We assume a monotonic relationship and use a binary
-       search to find a value that yields the desired result"""
+       search to find a value that yields the desired result.
+       Returns the queue size, and the bracket (lo, hi) around it:
+       from just above the largest queue size whose band was clearly
+       below the target to the smallest whose band was clearly above
+       it.  The bracket comes from test_q's stopping rule, and is not
+       a confidence interval.  nflows is the number of flows per host,
+       connections the ConnectionLog of the iperf server, and
+       connected the number of connections it had logged before
+       they were started.  Also returns a dict of
+       the calibration statistics and number of samples taken."""
 
     bdp = args.bw_net * 2 * args.delay * 1000.0 / 8.0 / 1500.0
-    nflows = args.nflows * (args.n - 1)
+    nflows = nflows * (args.n - 1)
     min_q, max_q = 1, int(bdp)
 
     # Set a higher speed
     set_speed(iface, "2Gbit")
 
-    succeeded = 0
-    wait_time = 300
-    while wait_time > 0 and succeeded != nflows:
-        wait_time -= 1
-        succeeded = count_connections()
-        print 'Connections %d/%d  \r' % (succeeded, nflows),
-        sys.stdout.flush()
-        sleep(1)
+    succeeded = connections.wait(connected + nflows) - connected
 
     monitor = Process(target=monitor_qlen,
                       args=(iface, 0.01, '%s/qlen_%s.txt' %
-                            (args.dir, iface)))
+                            (dir, iface)))
     monitor.start()
 
-    if succeeded != nflows:
+    if succeeded < nflows:
         print 'Giving up'
-        return -1
+        monitor.terminate()
+        return -1, (-1, -1), {}
 
     set_speed(iface, "%.2fMbit" % args.bw_net)
     print "\nSetting q=%d " % max_q,
@@ -316,6 +488,8 @@ def do_sweep(iface):
                 (reference_rate, ru_max, ru_stdev), 'blue')
         sys.stdout.flush()
 
+    samples = {}
+    below, above = [0], [max_q]
     while abs(min_q - max_q) >= 2:
         mid = (min_q + max_q) / 2
         print "Trying q=%d  [%d,%d] " % (mid, min_q, max_q),
@@ -327,15 +501,15 @@ def do_sweep(iface):
         # "mid" is valid.  You may use the helper functions set_q(),
         # get_rates(), avg(), median() and ok()
 
-        current_rate = -1
-        set_q(iface, mid)
-        rates = get_rates(iface)
-        current_rate = median(rates)
-
-        fraction = current_rate / reference_rate
-        print " Utilisation %s [%s]" % (
-                    format_fraction(fraction), format_floats(rates))
+        fraction, half = test_q(iface, mid, reference_rate, samples)
+        print " Utilisation %s +/- %.3f [%s]" % (
+                    format_fraction(fraction), half,
+                    format_floats(samples[mid]))
 
+        if fraction - half >= args.target:
+            above.append(mid)
+        elif fraction + half < args.target:
+            below.append(mid)
         if ok(fraction):
             max_q = mid
         else:
@@ -343,8 +517,13 @@ def do_sweep(iface):
         ######################## End: delete code ##############################
 
     monitor.terminate()
-    print "*** Minq for target: %d" % max_q
-    return max_q
+    bracket = (min(max(below) + 1, max_q), max(min(above), max_q))
+    print "*** Minq for target: %d (bracket [%d, %d], %d samples)" % (
+        max_q, bracket[0], bracket[1], sum(map(len, samples.values())))
+    stats = dict(ref_rate=reference_rate, ref_max=ru_max,
+                 ref_stdev=ru_stdev,
+                 samples=sum(map(len, samples.values())))
+    return max_q, bracket, stats
 
 ############### Begin: Partially Empty Code for Students to Fill
 
@@ -353,7 +532,7 @@ def do_sweep(iface):
 
 def verify_latency(net):
     "(Incomplete) verify link latency"
-    h1 = net.getNodeByName('h1')
+    h1 = net.getNodeByName(args.prefix + 'h1')
     h1.sendCmd('ping -c 2 10.0.0.2')
     result = h1.waitOutput()
     print "Ping result:"
@@ -375,11 +554,16 @@ def main():
     seconds = 3600
     start = time()
     # Reset to known state
+    cores = None
+    if args.cpus:
+        cores = map(int, args.cpus.split(','))
     topo = StarTopo(n=args.n, bw_host=args.bw_host,
                     delay='%sms' % args.delay,
-                    bw_net=args.bw_net, maxq=args.maxq)
+                    bw_net=args.bw_net, maxq=args.maxq,
+                    prefix=args.prefix, cores=cores)
     net = Mininet(topo=topo, host=CPULimitedHost, link=TCLink,
-                  autoPinCpus=True)
+                  controller=custom(Controller, port=args.port),
+                  autoPinCpus=not cores)
     net.start()
     dumpNodeConnections(net.hosts)
     net.pingAll()
@@ -387,16 +571,16 @@ def main():
     # verify latency and bandwidth of the setup
     verify_latency(net)
     get = net.getNodeByName
-    h1, h2, h3 = get('h1', 'h2', 'h3')
+    h1, h2, h3 = [get(args.prefix + h) for h in ('h1', 'h2', 'h3')]
     verify_bandwidth(net, h2, h3)
 
     # TODO
     # set h1 to the Node object of the receiver host
     # hint: use getNodeByName
-    h1 = net.getNodeByName('h1')
+    h1 = net.getNodeByName(args.prefix + 'h1')
     h1.sendCmd('%s -s -p %s > %s/iperf_server.txt &' %
                (CUSTOM_IPERF_PATH, 5001, args.dir))
-    clients = []
+    connections = ConnectionLog("%s/iperf_server.txt" % args.dir)
     monitors = []
 
     # TODO
@@ -407,41 +591,76 @@ def main():
     # CUSTOM_IPERF_PATH, 5001, seconds, args.cong, args.dir,
     # node_name, output_file)
 
-    start_tcpprobe()
-
-    cprint("Starting experiment", "green")
-    ####################### Begin: Delete Code #######################
-    flowindex = -1
-    for i in xrange(1, args.n):
-        node_name = 'h%d' % (i+1)
-        h = net.getNodeByName(node_name)
-        clients.append( h )
-        for j in xrange(args.nflows):
-            flowindex += 1
-            cmd = ('%s -c 10.0.0.1 -p %s -t %d -i 1 '
-                   '-yc -Z %s > %s/iperf_%s_%d.txt &' %
-                   (CUSTOM_IPERF_PATH, 5001, seconds,
-                    args.cong, args.dir, node_name, j))
-            h.cmd(cmd)
-            sleep(0.001)
-    ####################### End: Delete Code #######################
+    tcpprobe = None
+    if args.tcpprobe:
+        tcpprobe = start_tcpprobe()
 
     # TODO: change the interface for which queue size is adjusted
-    ret = do_sweep(iface='s0-eth1')
-    total_flows = flowindex + 1
-
-    # Store output
-    output = "%d %s %.3f\n" % (total_flows, ret, ret * 1500.0)
-    open("%s/result.txt" % args.dir, "w").write(output)
+    iface = args.prefix + 's0-eth1'
+    point_dir = args.point_dir
+    if point_dir is None:
+        point_dir = '%(dir)s/nf%(nflows)d' if len(args.nflows) > 1 else '%(dir)s'
+
+    # The network, and the iperf server, are kept for all the numbers
+    # of flows: only the flows, and the queue, are reset between them.
+    for nflows in args.nflows:
+        dir = point_dir % {'dir': args.dir, 'nflows': nflows}
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        connected = connections.count()
+        point_start = time()
+
+        cprint("Starting experiment with %d flows per host" % nflows, "green")
+        ####################### Begin: Delete Code #######################
+        flowindex = -1
+        clients = []
+        for i in xrange(1, args.n):
+            node_name = args.prefix + 'h%d' % (i+1)
+            h = net.getNodeByName(node_name)
+            clients.append( h )
+            for j in xrange(nflows):
+                flowindex += 1
+                cmd = ('%s -c 10.0.0.1 -p %s -t %d -i 1 '
+                       '-yc -Z %s > %s/iperf_%s_%d.txt &' %
+                       (CUSTOM_IPERF_PATH, 5001, seconds,
+                        args.cong, dir, node_name, j))
+                h.cmd(cmd)
+                sleep(0.001)
+        ####################### End: Delete Code #######################
+
+        ret, bracket, stats = do_sweep(iface, nflows, dir, connections, connected)
+        total_flows = flowindex + 1
+
+        # Store output
+        output = "%d %s %.3f %d %d\n" % (total_flows, ret, ret * 1500.0,
+                                         bracket[0], bracket[1])
+        open("%s/result.txt" % dir, "w").write(output)
+        if args.results:
+            results.add(args.results, dir=dir, n=args.n, flows=nflows,
+                        bw_net=args.bw_net, delay=args.delay,
+                        cong=args.cong, run=args.run,
+                        total_flows=total_flows, minq=ret,
+                        bytes=ret * 1500.0, q_lo=bracket[0], q_hi=bracket[1],
+                        duration=time() - point_start, **stats)
+
+        # Stop the clients (children of their hosts' shells), and put
+        # the queue back as it was.
+        os.system('pkill -9 -P %s' % ','.join(str(h.pid) for h in clients))
+        set_q(iface, args.maxq)
+        set_speed(iface, "%.2fMbit" % args.bw_net)
+        sleep(DRAIN_SEC)
 
     for monitor in monitors:
         monitor.terminate()
 
-    # Shut down iperf processes
-    os.system('killall -9 ' + CUSTOM_IPERF_PATH)
+    # Shut down iperf processes: only ours (children of our hosts'
+    # shells), as other experiments may be running alongside.
+    os.system('pkill -9 -P %s' % ','.join(str(h.pid) for h in net.hosts))
 
     net.stop()
-    Popen("killall -9 top bwm-ng tcpdump cat", shell=True).wait()
+    if tcpprobe:
+        tcpprobe.kill()
+        tcpprobe.wait()
     end = time()
     cprint("Sweep took %.3f seconds" % (end - start), "yellow")
 
@@ -7,6 +7,8 @@ sys.path.append('../../util')
 from util.helper import *
 import glob
 from collections import defaultdict
+import numpy as np
+import results
 import plot_defaults
 from matplotlib import rc, rcParams
 
@@ -26,14 +28,31 @@ parser.add_argument('--dir',
                     help="Directory from which outputs of the sweep are read.",
                     required=True)
 
+parser.add_argument('--db',
+                    dest="db",
+                    help="Results database (default: DIR/results.db, made "
+                    "from DIR/*/result.txt if there is none)",
+                    default=None)
+
+parser.add_argument('--bw-net',
+                    dest="bw_net",
+                    type=float,
+                    help="Only plot results with this bandwidth",
+                    default=None)
+
+parser.add_argument('--delay',
+                    dest="delay",
+                    type=float,
+                    help="Only plot results with this delay",
+                    default=None)
+
+parser.add_argument('--cong',
+                    dest="cong",
+                    help="Only plot results with this congestion control",
+                    default=None)
+
 args = parser.parse_args()
-data = defaultdict(list)
 nedata = defaultdict(list)
-RTT = 85.0 # ms
-BW = 62.5 # Mbps
-nruns = 10 # Number of runs for your experiment
-nflows = 800
-nfiles = 0
 
 def first(lst):
     return map(lambda e: e[0], lst)
@@ -49,15 +68,6 @@ def median(lst):
     lst.sort()
     return lst[l/2]
 
-def parse_data(filename):
-    lines = open(filename).read().split("\n")
-    for l in lines:
-        if l.strip() == "":
-            continue
-        x, pkt, byte = map(float, l.split(' '))
-        data[int(x)].append(byte/1024.0)
-    return
-
 def parse_nedata2(filename):
     lines = open(filename).read().split("\n")
     for l in lines:
@@ -68,23 +78,55 @@ def parse_nedata2(filename):
         nedata[x].append(y / 1024.0)
     return
 
-for f in glob.glob("%s/*/result.txt" % args.dir):
-    print "Parsing %s" % f
-    parse_data(f)
-    nfiles += 1
-
-if nfiles == 0:
-    print "Result files not found.   Did you pass the directory correctly?"
+db = args.db or os.path.join(args.dir, 'results.db')
+if not os.path.exists(db):
+    dirs = [os.path.dirname(f)
+            for f in glob.glob("%s/*/result.txt" % args.dir)]
+    if not dirs:
+        print "Result files not found.   Did you pass the directory correctly?"
+        sys.exit(0)
+    print "Importing %d result files into %s" % (len(dirs), db)
+    # Older sweeps' directories do not say their configuration.
+    results.import_dirs(db, dirs, bw_net=args.bw_net, delay=args.delay,
+                        cong=args.cong)
+
+where = ['minq >= 0']
+params = {}
+for column in ['bw_net', 'delay', 'cong']:
+    if getattr(args, column) is not None:
+        where.append('%s = :%s' % (column, column))
+        params[column] = getattr(args, column)
+data = results.query(db, ['total_flows', 'run', 'bytes', 'bw_net', 'delay',
+                          'cong'], ' AND '.join(where), **params)
+if not len(data['bytes']):
+    print "No results in %s." % db
     sys.exit(0)
 
-plot_quido = []
-plot_bdp = []
-plot_data = []
-for n in sorted(data.keys()):
-    bdp = (RTT * 1000 * BW / 8.0 / 1024.0)
-    quido =  bdp / math.sqrt(n)
-    plot_quido.append((n, quido))
-    plot_bdp.append((n, bdp))
+# One curve is one configuration: averaging across them means nothing.
+configs = sorted(set(zip(data['bw_net'].tolist(), data['delay'].tolist(),
+                         data['cong'].tolist())))
+if len(configs) > 1:
+    print "%s has results for more than one configuration; choose one" % db
+    print "with --bw-net, --delay and --cong:"
+    for config in configs:
+        print "  bw_net %s delay %s cong %s" % config
+    sys.exit(1)
+BW, delay, cong = configs[0]  # Mbps, ms
+if BW is None or delay is None:
+    print "The results in %s do not say their bandwidth and delay;" % db
+    print "remove it, and import them again with --bw-net and --delay."
+    sys.exit(1)
+# The path from a sender to h1 has one link of @delay each way.
+RTT = 2 * delay  # ms
+
+flows = data['total_flows'].astype(int)
+kbytes = data['bytes'] / 1024.0
+mn_keys, index = np.unique(flows, return_inverse=True)
+nflows = int(math.ceil(mn_keys.max() / 100.0)) * 100
+
+bdp = (RTT * 1000 * BW / 8.0 / 1024.0)
+plot_quido = zip(mn_keys, bdp / np.sqrt(mn_keys))
+plot_bdp = zip(mn_keys, [bdp] * len(mn_keys))
 
 PHI=1.618
 fig = plt.figure(figsize=(8, 8/PHI))
@@ -103,26 +145,17 @@ plt.plot(keys, median_yneda, lw=2, label="Hardware",
          color="black", ls='--', marker='d', markersize=10)
 
 
-keys = list(sorted(data.keys()))
-
-for i in xrange(nruns):
-    try:
-        values = [mndata[k][i] for k in keys]
-    except:
-        break
+# One thin line per run
+runs = data['run']
+for run in np.unique(runs):
+    mask = runs == run
+    order = np.argsort(flows[mask])
+    plt.plot(flows[mask][order], kbytes[mask][order],
+             lw=1, color="red")
 
-    if i == 0:
-        label = "Mininet-HiFi"
-    else:
-        label = ''
-    plt.plot(keys, values,
-             lw=1, label=label, color="red")
-
-avg_mn = []
-for k in keys:
-    avg_mn.append(avg(data[k]))
+avg_mn = np.bincount(index, weights=kbytes) / np.bincount(index)
 
-plt.plot(keys, avg_mn, lw=2, label="Mininet-HiFi", color="red", marker='s', markersize=10)
+plt.plot(mn_keys, avg_mn, lw=2, label="Mininet-HiFi", color="red", marker='s', markersize=10)
 
 #plt.xscale('log')
 plt.yscale('log')
@@ -132,7 +165,7 @@ plt.legend()
 plt.ylabel("Queue size")
 plt.xlabel("Total \#flows (n)")
 plt.grid(True)
-xticks = range(0, 801, 100)
+xticks = range(0, nflows + 1, 100)
 plt.xticks(xticks, map(str, xticks))
 
 yticks = [1, 10, 100, 1000]
@@ -0,0 +1,109 @@
+'''
+Results of buffer sizing experiments, kept in one SQLite database (one
+row per run of do_sweep) rather than in a result.txt per directory.
+Runs can add rows concurrently; readers get whole columns back as NumPy
+arrays.
+'''
+
+import numpy as np
+import os
+import re
+import sqlite3
+from time import time
+
+# (column, SQL type) of the results table.
+COLUMNS = [
+    ('time', 'REAL'),          # when the result was recorded (s since epoch)
+    ('dir', 'TEXT'),           # where the run's outputs are
+    ('n', 'INTEGER'),          # nodes in the star
+    ('flows', 'INTEGER'),      # flows per sending host
+    ('bw_net', 'REAL'),        # Mbps
+    ('delay', 'REAL'),         # ms, of each host link
+    ('cong', 'TEXT'),
+    ('run', 'INTEGER'),
+    ('total_flows', 'INTEGER'),
+    ('minq', 'INTEGER'),       # packets; -1 if the run gave up
+    ('bytes', 'REAL'),
+    ('q_lo', 'INTEGER'),       # bracket around minq from the sweep's
+    ('q_hi', 'INTEGER'),       # stopping rule (not a confidence interval)
+    ('samples', 'INTEGER'),    # utilisation samples taken
+    ('ref_rate', 'REAL'),      # calibration: median, max, stdev (Mbps)
+    ('ref_max', 'REAL'),
+    ('ref_stdev', 'REAL'),
+    ('duration', 'REAL'),      # seconds the run took
+]
+
+# The columns that identify a configuration.
+CONFIG = ['bw_net', 'delay', 'cong', 'n', 'total_flows']
+
+def connect(fname):
+    # Concurrent sweep runs wait for each other's writes.
+    db = sqlite3.connect(fname, timeout=60)
+    db.execute('CREATE TABLE IF NOT EXISTS results (%s)' %
+               ', '.join('%s %s' % c for c in COLUMNS))
+    db.execute('CREATE INDEX IF NOT EXISTS results_config ON results (%s)' %
+               ', '.join(CONFIG))
+    return db
+
+def add(fname, **values):
+    """Add a result, with the @values of (some of) COLUMNS."""
+    values.setdefault('time', time())
+    names = [c for c, _ in COLUMNS if c in values]
+    db = connect(fname)
+    with db:
+        db.execute('INSERT INTO results (%s) VALUES (%s)' %
+                   (', '.join(names), ', '.join('?' * len(names))),
+                   [values[c] for c in names])
+    db.close()
+
+# The names of the directories of a sweep.py sweep, and of a sweep
+# from before it (by buffersizing-sweep.sh), which only had the flows
+# per host and the run in them.
+SWEEP_DIR = re.compile(r'nf(\d+)-bw([^-]+)-d([^-]+)-(.+)-r(\d+)$')
+LEGACY_DIR = re.compile(r'nf(\d+)-r(\d+)$')
+
+def import_dirs(fname, dirs, **defaults):
+    """Add the results in the result.txt ("total_flows minq bytes
+    [q_lo q_hi]") of each of @dirs, for sweeps from before there
+    was a database.  @defaults (e.g. bw_net, delay) fill in the columns
+    that neither result.txt nor the directory's name give."""
+    db = connect(fname)
+    with db:
+        for dir in dirs:
+            for line in open(os.path.join(dir, 'result.txt')):
+                values = line.split()
+                if not values:
+                    continue
+                row = dict((k, v) for k, v in defaults.items()
+                           if v is not None)
+                row.update(zip(['total_flows', 'minq', 'bytes', 'q_lo',
+                                'q_hi'], values))
+                row['dir'] = dir
+                row['run'] = 1
+                m = SWEEP_DIR.search(dir.rstrip('/'))
+                if m:
+                    row.update(zip(['flows', 'bw_net', 'delay', 'cong', 'run'],
+                                   m.groups()))
+                m = LEGACY_DIR.search(dir.rstrip('/'))
+                if m:
+                    row.update(zip(['flows', 'run'], m.groups()))
+                names = sorted(row)
+                db.execute('INSERT INTO results (%s) VALUES (%s)' %
+                           (', '.join(names), ', '.join('?' * len(names))),
+                           [row[c] for c in names])
+    db.close()
+
+def query(fname, columns, where=None, order=None, **params):
+    """Returns a dict of NumPy arrays, one for each of @columns, of the
+    results that match the SQL condition @where (with named @params)."""
+    sql = 'SELECT %s FROM results' % ', '.join(columns)
+    if where:
+        sql += ' WHERE ' + where
+    if order:
+        sql += ' ORDER BY ' + order
+    db = connect(fname)
+    rows = db.execute(sql, params).fetchall()
+    db.close()
+    if not rows:
+        return dict((c, np.zeros(0)) for c in columns)
+    return dict((c, np.array(v)) for c, v in zip(columns, zip(*rows)))
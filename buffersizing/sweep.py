@@ -0,0 +1,244 @@
+#!/usr/bin/python
+
+"""
+Run buffersizing.py over a grid of configurations, several at a time.
+
+Each configuration runs in its own Mininet, on a set of CPUs of its own
+(whole physical cores, where the CPU topology is known), with its own
+node names and controller port, so configurations do not disturb one
+another.  As many run at once as there are such CPU sets (or --jobs, if
+fewer).  A configuration whose directory already has a result.txt is
+not run again, so an interrupted sweep resumes where it left off.
+When the grid is done, all the results are collected in one table,
+DIR/results.txt.  Each run also adds its results to the database
+DIR/results.db, which plot-results.py reads.
+
+With --warm, each combination of the other parameters runs all its
+flow counts in turn in one buffersizing.py, on one network (whose
+shared logs go in DIR/warm-...), rather than building a network for
+each.
+"""
+
+from argparse import ArgumentParser
+from subprocess import Popen
+from time import sleep, time
+import itertools
+import os
+import sys
+
+parser = ArgumentParser(description="Buffer sizing sweep")
+parser.add_argument('--dir', '-d',
+                    dest="dir",
+                    help="Directory to store outputs (and resume from)",
+                    required=True)
+
+parser.add_argument('--flows',
+                    dest="flows",
+                    help="Comma-separated flows per host",
+                    default="1,2,5,10,50,100,200,300,400")
+
+parser.add_argument('--bw-net', '-b',
+                    dest="bw_net",
+                    help="Comma-separated bandwidths of network link",
+                    default="62.5")
+
+parser.add_argument('--delay',
+                    dest="delay",
+                    help="Comma-separated delays (ms) of host links",
+                    default="43.5")
+
+parser.add_argument('--cong',
+                    dest="cong",
+                    help="Comma-separated congestion control algorithms",
+                    default="bic")
+
+parser.add_argument('--runs', '-r',
+                    dest="runs",
+                    type=int,
+                    help="Runs of each configuration",
+                    default=1)
+
+parser.add_argument('--bw-host', '-B',
+                    dest="bw_host",
+                    type=float,
+                    help="Bandwidth of host links",
+                    default=1000)
+
+parser.add_argument('-n',
+                    dest="n",
+                    type=int,
+                    help="Number of nodes in star",
+                    default=3)
+
+parser.add_argument('--cpus-per-run',
+                    dest="cpus_per_run",
+                    type=int,
+                    help="CPUs for each configuration (default: one per node)",
+                    default=None)
+
+parser.add_argument('--jobs', '-j',
+                    dest="jobs",
+                    type=int,
+                    help="Most configurations to run at once "
+                    "(default: as many as there are CPU sets)",
+                    default=None)
+
+parser.add_argument('--warm',
+                    dest="warm",
+                    action="store_true",
+                    help="Run all flow counts of a configuration on one network",
+                    default=False)
+
+parser.add_argument('--iperf',
+                    dest="iperf",
+                    help="Path to custom iperf",
+                    required=True)
+
+args = parser.parse_args()
+
+# Columns of DIR/results.txt: the configuration, then result.txt's.
+RESULT_COLUMNS = ['flows', 'bw_net', 'delay', 'cong', 'run',
+                  'total_flows', 'minq', 'bytes', 'q_lo', 'q_hi']
+
+# Controller port of the configuration in slot i: BASE_PORT + 10 * i.
+BASE_PORT = 6633
+
+def split(s, type=str):
+    return [type(v) for v in s.split(',')]
+
+def physical_cores():
+    """Lists the CPUs of each physical core, ordered by socket and core,
+    so that consecutive cores are close together."""
+    cores = {}
+    ncpus = os.sysconf('SC_NPROCESSORS_ONLN')
+    for cpu in xrange(ncpus):
+        topology = '/sys/devices/system/cpu/cpu%d/topology/' % cpu
+        try:
+            package = int(open(topology + 'physical_package_id').read())
+            core = int(open(topology + 'core_id').read())
+        except IOError:
+            package, core = 0, cpu
+        cores.setdefault((package, core), []).append(cpu)
+    return [cores[k] for k in sorted(cores)]
+
+def cpu_sets(size):
+    """Disjoint sets of at least @size CPUs, made of whole physical
+    cores, so that no two sets share a core."""
+    sets, cur = [], []
+    for cpus in physical_cores():
+        cur.extend(cpus)
+        if len(cur) >= size:
+            sets.append(cur)
+            cur = []
+    if not sets:
+        # Too few CPUs for even one set: share them all.
+        sets.append(cur)
+    return sets
+
+def configurations():
+    """The grid, as (name, flows, bw_net, delay, cong, run) tuples."""
+    grid = itertools.product(split(args.flows, int), split(args.bw_net),
+                             split(args.delay), split(args.cong),
+                             xrange(1, args.runs + 1))
+    for flows, bw_net, delay, cong, run in grid:
+        name = 'nf%d-bw%s-d%s-%s-r%d' % (flows, bw_net, delay, cong, run)
+        yield (name, flows, bw_net, delay, cong, run)
+
+def done(name):
+    result = os.path.join(args.dir, name, 'result.txt')
+    return os.path.exists(result) and open(result).read().strip()
+
+def jobs(todo):
+    """Groups the configurations in @todo into runs of buffersizing.py:
+    each on its own, or, with --warm, all those that differ only in
+    the number of flows together."""
+    if not args.warm:
+        return [[config] for config in todo]
+    groups = {}
+    for config in todo:
+        groups.setdefault(config[2:], []).append(config)
+    return [groups[k] for k in sorted(groups, key=lambda k: todo.index(groups[k][0]))]
+
+def launch(job, slot, cpus, tcpprobe):
+    name, flows, bw_net, delay, cong, run = job[0]
+    dir = os.path.join(args.dir, name)
+    point_args = []
+    if args.warm:
+        # name is nfFLOWS-REST
+        rest = name[name.index('-'):]
+        dir = os.path.join(args.dir, 'warm' + rest)
+        name = 'nf' + ','.join(str(c[1]) for c in job) + rest
+        point_args = ['--point-dir',
+                      os.path.join(args.dir, 'nf%(nflows)d' + rest)]
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+    cmd = ['taskset', '-c', ','.join(map(str, cpus)),
+           sys.executable, 'buffersizing.py',
+           '--bw-host', str(args.bw_host),
+           '--bw-net', bw_net,
+           '--delay', delay,
+           '--cong', cong,
+           '--dir', dir,
+           '--nflows', ','.join(str(c[1]) for c in job),
+           '-n', str(args.n),
+           '--iperf', args.iperf,
+           '--prefix', chr(ord('a') + slot),
+           '--port', str(BASE_PORT + 10 * slot),
+           '--cpus', ','.join(map(str, cpus[:args.n])),
+           '--results', os.path.join(args.dir, 'results.db'),
+           '--run', str(run)] + point_args
+    if not tcpprobe:
+        cmd.append('--no-tcpprobe')
+    log = open(os.path.join(dir, 'log.txt'), 'w')
+    print 'Starting %s on CPUs %s' % (name, ','.join(map(str, cpus)))
+    return Popen(cmd, stdout=log, stderr=log)
+
+def run_all(todo):
+    sets = cpu_sets(args.cpus_per_run or args.n)
+    nslots = min(len(sets), args.jobs or len(sets), 26)
+    # With one experiment at a time, it can have tcp_probe to itself.
+    tcpprobe = nslots == 1
+    free = range(nslots)
+    todo = jobs(todo)
+    running = {}  # slot => (job, Popen)
+    while todo or running:
+        while todo and free:
+            slot = free.pop(0)
+            job = todo.pop(0)
+            running[slot] = (job, launch(job, slot, sets[slot], tcpprobe))
+        sleep(1)
+        for slot, (job, p) in running.items():
+            if p.poll() is not None:
+                for config in job:
+                    status = 'done' if done(config[0]) else 'FAILED (%d)' % p.returncode
+                    print 'Finished %s: %s' % (config[0], status)
+                del running[slot]
+                free.append(slot)
+
+def write_results():
+    """Collect every result.txt into DIR/results.txt, and print it."""
+    rows = []
+    for config in configurations():
+        result = done(config[0])
+        if not result:
+            continue
+        values = result.split()
+        values += ['-'] * (len(RESULT_COLUMNS) - 5 - len(values))
+        rows.append(map(str, config[1:]) + values)
+    lines = [' '.join(RESULT_COLUMNS)] + [' '.join(row) for row in rows]
+    open(os.path.join(args.dir, 'results.txt'), 'w').write('\n'.join(lines) + '\n')
+    print '\n'.join(lines)
+
+def main():
+    start = time()
+    if not os.path.exists(args.dir):
+        os.makedirs(args.dir)
+    configs = list(configurations())
+    todo = [config for config in configs if not done(config[0])]
+    print '%d of %d configurations to run' % (len(todo), len(configs))
+    run_all(todo)
+    write_results()
+    print "Sweep took %.3f seconds" % (time() - start)
+
+if __name__ == '__main__':
+    main()
@@ -117,7 +117,7 @@ def CPUIsolationTest(opts):
                     for j in range(opts.numprocs):
                         # was: c = cmd[j*n + i].waitOutput()
                         c = server.waitOutput()
-                    #stop_monitor_cpu(server)
+                    #stop_monitor_cpu(monitor[i])
                     # sleep(0.5)
                     #cpu_log[i] = parse_cpu_log(monitor_outfile[i])
                     #quietRun('rm -rf %s' % monitor_outfile[i])
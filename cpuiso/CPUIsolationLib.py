@@ -18,6 +18,10 @@ from mininet.topo import Topo
 from mininet.util import quietRun, numCores, natural
 from mininet.log import lg, setLogLevel, info, warn, output
 
+sys.path.append('..')
+from util.monitor import CPUAcctProbe, MonitorScheduler
+from util.sink import read_samples
+
 CPUDIR = '../cpuiso/cpu'
 
 class CPUIsolationHost( CPULimitedHost ):
@@ -33,49 +37,30 @@ class CPUIsolationTopo( Topo ):
         for i in range( 1, N+1 ):
             self.add_host( 'h%s' % i )
 
-def get_cpu_pid(s):
-    out, err, code  = s.pexec( 'ps aux' )
-    lines = out.split('\n')
-    for l in lines:
-        if re.search('cpu-stress', l) is not None:
-            if len(l) > 2:
-                return int(l.split()[1])
-    return None
-
-def start_monitor_cpu(s, fname):
-    bash = quietRun('which bash').strip()
-    pid = None
-    print 'Getting PID of the cpu-stress process in host %s' % s.name
-    while pid is None:
-        print '.',
-        pid = get_cpu_pid(s)
-        sleep(0.5)
-    print 'pid: %d' % pid
+def start_monitor_cpu(s, fname, interval=1.0):
+    """Logs the CPU usage of host @s, from its cgroup, every @interval
+    seconds to @fname; returns the monitor, to pass to stop_monitor_cpu.
+    This is everything the host runs (its shell included), not just the
+    cpu-stress process that top used to be pointed at; in these tests
+    the host runs little else."""
     quietRun('rm -rf %s' % fname)
-    cpu_stress_cmd = ('%s -c "(top -b -p %d -d 1 | grep --line-buffered cpu-stress) > %s" &' % 
-                      (bash, pid, fname))
-    print cpu_stress_cmd
-    return s.cmd(cpu_stress_cmd)
+    monitor = MonitorScheduler([CPUAcctProbe([s.name], fname, interval,
+                                             percpu=False)])
+    monitor.start()
+    return monitor
 
-def stop_monitor_cpu(s):
-    s.cmd('killall -9 top')
+def stop_monitor_cpu(monitor):
+    monitor.stop()
 
 def parse_cpu_log(fname):
-    f = open(fname, 'r')
+    """Returns the CPU usage (% of one CPU) of the host's whole cgroup,
+    as logged by start_monitor_cpu, against the time (s) since the
+    first sample."""
     ret = {'xvals':[], 'cpuvals':[]}
-    cur_time, cur_cpu = 0, None
-    for l in f:
-        vals = l.split()
-        if len(vals) < 12:
-            continue
-        if re.search('cpu-stress', l) is not None:
-            cur_cpu = float(vals[8])
-            ret['xvals'].append(cur_time)
-            ret['cpuvals'].append(cur_cpu)
-            cur_time += 1
-    #ignore the first value -- it's usually a bad value
-    ret['xvals'].pop()
-    ret['cpuvals'].pop(0)
+    samples = read_samples(fname)
+    for t, elapsed, name, usage, user, system in samples:
+        ret['xvals'].append(t - samples[0][0])
+        ret['cpuvals'].append(100.0 * usage)
     return ret
 
 def diff_list(L):
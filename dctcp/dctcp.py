@@ -11,14 +11,13 @@ from mininet.util import irange, custom, quietRun, dumpNetConnections
 from mininet.cli import CLI
 
 from time import sleep, time
-import multiprocessing
 from subprocess import Popen, PIPE
 import re
 import termcolor as T
 import argparse
 
 import os
-from util.monitor import monitor_cpu, monitor_qlen, monitor_devs_ng
+from util.monitor import MonitorScheduler, CPUProbe, QlenProbe, RateProbe
 
 parser = argparse.ArgumentParser(description="DCTCP tester (Star topology)")
 parser.add_argument('--bw', '-B',
@@ -198,19 +197,12 @@ def main():
     clients = [net.getNodeByName('h%d' % (i+1)) for i in xrange(1, args.n)]
     waitListening(clients[0], h1, 5001)
 
-    monitors = []
-
-    monitor = multiprocessing.Process(target=monitor_cpu, args=('%s/cpu.txt' % args.dir,))
-    monitor.start()
-    monitors.append(monitor)
-
-    monitor = multiprocessing.Process(target=monitor_qlen, args=('s1-eth1', 0.01, '%s/qlen_s1-eth1.txt' % (args.dir)))
-    monitor.start()
-    monitors.append(monitor)
-
-    monitor = multiprocessing.Process(target=monitor_devs_ng, args=('%s/txrate.txt' % args.dir, 0.01))
+    monitor = MonitorScheduler(drift_fname='%s/monitor_drift.txt' % args.dir)
+    monitor.add(CPUProbe('%s/cpu.txt' % args.dir))
+    monitor.add(QlenProbe(['s1-eth1'], 0.01,
+                          {'s1-eth1': '%s/qlen_s1-eth1.txt' % args.dir}))
+    monitor.add(RateProbe('%s/txrate.txt' % args.dir, 0.01))
     monitor.start()
-    monitors.append(monitor)
     Popen("rmmod tcp_probe; modprobe tcp_probe; cat /proc/net/tcpprobe > %s/tcp_probe.txt" % args.dir, shell=True)
     #CLI(net)
 
@@ -232,8 +224,7 @@ def main():
 		    %s/%s_tcpdump.pcap' % (node_name, args.dir, node_name), 
 		    shell=True)
     progress(seconds)
-    for monitor in monitors:
-        monitor.terminate()
+    monitor.stop()
 
     net.getNodeByName('h1').pexec("/bin/netstat -s > %s/netstat.txt" %
 	    args.dir, shell=True)
@@ -244,7 +235,7 @@ def main():
     net.stop()
     disable_dctcp()
     disable_tcp_ecn()
-    Popen("killall -9 cat ping top bwm-ng", shell=True).wait()
+    Popen("killall -9 cat ping top", shell=True).wait()
 
 if __name__ == '__main__':
     main()
@@ -15,7 +15,6 @@ import json
 from time import sleep
 from optparse import OptionParser
 from subprocess import Popen, PIPE
-import multiprocessing
 import termcolor as T
 
 from mininet.net import Mininet
@@ -25,7 +24,7 @@ from mininet.cli import CLI
 from mininet.log import setLogLevel, info, warn, error, debug
 from mininet.util import custom, quietRun, run
 
-from util.monitor import monitor_cpu, monitor_devs_ng
+from util.monitor import MonitorScheduler, CPUProbe, RateProbe
 from dctopo import FatTreeTopo
 from NonBlockingTopo import NonBlockingTopo
 
@@ -156,20 +155,15 @@ def trafficGenPairs(opts, hosts, net):
     for h in hosts:
         h.cmd('nc -nzv %s %d' % (h.IP(), listen_port))
 
-    monitors = []
-
-    monitors.append(multiprocessing.Process(target=monitor_cpu,
-	args=('%s/cpu.txt' % opts.outputdir,)))
-    monitors.append(multiprocessing.Process(target=monitor_devs_ng,
-	args=('%s/txrate.txt' % opts.outputdir, 0.01)))
-
-    for m in monitors:
-	m.start()
+    monitor = MonitorScheduler(
+        drift_fname='%s/monitor_drift.txt' % opts.outputdir)
+    monitor.add(CPUProbe('%s/cpu.txt' % opts.outputdir))
+    monitor.add(RateProbe('%s/txrate.txt' % opts.outputdir, 0.01))
+    monitor.start()
 
     progress(opts.time)
 
-    for m in monitors:
-	m.terminate()
+    monitor.stop()
 
     info('** Stopping load-generators\n')
     for h in hosts:
@@ -253,6 +247,6 @@ if __name__ == '__main__':
 
     disable_dctcp()
 
-    Popen("killall -9 top bwm-ng", shell=True).wait()
+    Popen("killall -9 top", shell=True).wait()
     clean()
     os.system('sudo mn -c')
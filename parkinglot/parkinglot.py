@@ -14,13 +14,12 @@ from mininet.util import irange, custom, quietRun, dumpNetConnections
 from mininet.cli import CLI
 
 from time import sleep, time
-from multiprocessing import Process
 from subprocess import Popen
 import termcolor as T
 import argparse
 
 import os
-from util.monitor import monitor_cpu, monitor_qlen, monitor_devs_ng
+from util.monitor import MonitorScheduler, CPUProbe, QlenProbe, RateProbe
 
 
 def cprint(s, color, cr=True):
@@ -153,20 +152,12 @@ def run_parkinglot_expt(net, n):
     seconds = args.time
 
     # Start the bandwidth and cwnd monitors in the background
-    monitors = []
-
-    monitor = Process(target=monitor_devs_ng,
-                      args=('%s/bwm.txt' % args.dir, 1.0))
-    monitor.start()
-    monitors.append(monitor)
-
-    monitor = Process(target=monitor_cpu, args=('%s/cpu.txt' % args.dir,))
-    monitor.start()
-    monitors.append(monitor)
-
-    monitor = Process(target=monitor_qlen, args=('s1-eth1', 0.01, '%s/qlen_s1-eth1.txt' % (args.dir)))
+    monitor = MonitorScheduler(drift_fname='%s/monitor_drift.txt' % args.dir)
+    monitor.add(RateProbe('%s/bwm.txt' % args.dir, 1.0))
+    monitor.add(CPUProbe('%s/cpu.txt' % args.dir))
+    monitor.add(QlenProbe(['s1-eth1'], 0.01,
+                          {'s1-eth1': '%s/qlen_s1-eth1.txt' % args.dir}))
     monitor.start()
-    monitors.append(monitor)
 
     start_tcpprobe()
 
@@ -212,13 +203,12 @@ def run_parkinglot_expt(net, n):
     recvr.cmd('kill %iperf')
 
     # Shut down monitors
-    for monitor in monitors:
-	monitor.terminate()
+    monitor.stop()
     stop_tcpprobe()
 
 def check_prereqs():
     "Check for necessary programs"
-    prereqs = ['telnet', 'bwm-ng', 'iperf', 'ping']
+    prereqs = ['telnet', 'iperf', 'ping']
     for p in prereqs:
         if not quietRun('which ' + p):
             raise Exception((
@@ -256,7 +246,6 @@ def main():
 
     net.stop()
     end = time()
-    os.system("killall -9 bwm-ng")
     cprint("Experiment took %.3f seconds" % (end - start), "yellow")
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+"""
+Check that parse.py reports the same summaries with the event cache
+(FILE.cache.*) as without it, on a synthetic trace that ends with an
+event line.
+
+Usage: ./check-cache.py [LINES]
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+PARSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parse.py')
+
+def write_trace(fname, nlines, seed=1):
+    """A random mix of mn_sched_switch, mn_htb and other events, whose
+    last line is an mn_htb enqueue."""
+    rand = random.Random(seed)
+    t_us = 5000000123456
+    containers = ['h1', 'h2', '/', 'sysdefault']
+    current = {0: '/', 1: '/'}
+    qlen = {'s0-eth1': 0, 's0-eth2': 0}
+    f = open(fname, 'w')
+    f.write('# tracer: nop\n#\n')
+    for i in xrange(nlines):
+        t_us += rand.randint(1, 40)
+        ts = '%d.%06d' % (t_us // 10**6, t_us % 10**6)
+        cpu = rand.randint(0, 1)
+        r = rand.random() if i < nlines - 1 else 0.5
+        if r < 0.3:
+            next = rand.choice(containers)
+            f.write('          <idle>-0     [00%d] %s: mn_sched_switch: '
+                    'cpu %d, prev: %s, next: %s\n' %
+                    (cpu, ts, cpu, current[cpu], next))
+            current[cpu] = next
+        elif r < 0.8:
+            link = rand.choice(sorted(qlen))
+            if rand.random() < 0.5 or i == nlines - 1:
+                qlen[link] += 1
+                action = 'enqueue'
+            else:
+                qlen[link] = max(0, qlen[link] - 1)
+                action = 'dequeue'
+            f.write('     iperf-1234  [00%d] %s: mn_htb: action: %s, '
+                    'link: %s, len: %d\n' % (cpu, ts, action, link, qlen[link]))
+        else:
+            f.write('     iperf-1234  [00%d] %s: softirq_raise: vec=3 '
+                    '[action=NET_RX]\n' % (cpu, ts))
+    f.close()
+
+def summary(fname, odir, *args):
+    """parse.py's report, without the lines that say which way it was
+    made."""
+    out = subprocess.check_output([sys.executable, PARSE, '-f', fname,
+                                   '--odir', odir, '--plots', 'links'] +
+                                  list(args))
+    return [l for l in out.split('\n')
+            if not l.startswith('Building') and not l.startswith('Processed')]
+
+def main():
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    tmp = tempfile.mkdtemp()
+    failed = 0
+    try:
+        fname = os.path.join(tmp, 'trace.txt')
+        write_trace(fname, nlines)
+        odir = os.path.join(tmp, 'out')
+        for args in [[], ['--samples', str(nlines / 2)],
+                     ['--start', '0.1', '--end', '0.2']]:
+            expected = summary(fname, odir, '--no-cache', *args)
+            # Once to build the cache (when it can), once to load it.
+            for run in ('build', 'load'):
+                if summary(fname, odir, *args) != expected:
+                    print 'FAILED: cached (%s) %s' % (run, ' '.join(args))
+                    failed += 1
+    finally:
+        shutil.rmtree(tmp)
+    if not failed:
+        print 'OK'
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -9,11 +9,23 @@ if os.getenv("DISPLAY") == None:
 from matplotlib import rc
 import matplotlib.pyplot as plt
 import colorsys
+import itertools
+import json
+import math
+import mmap
+import numpy as np
+import select
+import stat
+import sys
+import tempfile
+import time
+import zipfile
+from multiprocessing import Pool
 
 rc('legend', **{'fontsize': 'small'})
 
-ALL_PLOTS = ['cpu', 'history', 'links', 'linkwindow']
-DEF_PLOTS = ['cpu', 'links', 'linkwindow']  # Adding 'history' is expensive
+ALL_PLOTS = ['cpu', 'history', 'links', 'linkwindow', 'qlen']
+DEF_PLOTS = ['cpu', 'history', 'links', 'linkwindow']
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-f',
@@ -73,7 +85,7 @@ parser.add_argument('--absolute',
 parser.add_argument('--plots',
                     type=str,
                     default=None,
-                    help="comma-sep list in [%s]" % ','.join(DEF_PLOTS))
+                    help="comma-sep list in [%s]" % ','.join(ALL_PLOTS))
 
 parser.add_argument('--intf',
                     default=None,
@@ -83,6 +95,55 @@ parser.add_argument('--output_link_data',
                     default=None,
                     help="save link stats data to a file")
 
+parser.add_argument('--jobs', '-j',
+                    type=int,
+                    default=1,
+                    help="parse the trace in JOBS parallel chunks")
+
+parser.add_argument('--no-index',
+                    dest="index",
+                    action="store_false",
+                    default=True,
+                    help="don't use (or build) the FILE.idx time index for --start/--end")
+
+parser.add_argument('--no-cache',
+                    dest="cache",
+                    action="store_false",
+                    default=True,
+                    help="don't use (or build) the FILE.cache.* decoded event cache")
+
+parser.add_argument('--sketch',
+                    action="store_true",
+                    default=False,
+                    help="keep bounded-size quantile sketches instead of every "
+                    "latency sample (no 'history', 'linkwindow' or 'qlen' plots)")
+
+parser.add_argument('--sketch-error',
+                    dest="sketch_error",
+                    type=float,
+                    default=0.01,
+                    help="relative error bound of --sketch quantiles (default 0.01)")
+
+parser.add_argument('--history-levels',
+                    dest="history_levels",
+                    type=int,
+                    default=0,
+                    help="also render the 'history' plot zoomed in 2x, 4x, .. 2^N, "
+                    "as 2, 4, .. 2^N tiles")
+
+parser.add_argument('--follow',
+                    action="store_true",
+                    default=False,
+                    help="tail FILE as it grows (or read it as a FIFO, e.g. "
+                    "trace_pipe; '-' is stdin), printing a rolling summary "
+                    "every --interval-ms; implies --sketch")
+
+parser.add_argument('--interval-ms',
+                    dest="interval_ms",
+                    type=float,
+                    default=1000,
+                    help="period of the --follow summary (default 1000)")
+
 parser.add_argument('--show',
                     type=bool,
                     default=False,
@@ -95,13 +156,27 @@ parser.add_argument('--logscale',
 
 args = parser.parse_args()
 
+if args.follow:
+    # A live trace has no end; keep bounded-size stats.
+    args.sketch = True
+
+# Plots that need every event time, which --sketch doesn't keep.
+SERIES_PLOTS = ['history', 'linkwindow', 'qlen']
+
 if not args.plots:
     args.plots = DEF_PLOTS
+    if args.sketch:
+        args.plots = [p for p in DEF_PLOTS if p not in SERIES_PLOTS]
 else:
     args.plots = args.plots.split(',')
     for plot in args.plots:
-        if plot not in DEF_PLOTS:
+        if plot not in ALL_PLOTS:
             raise Exception("unknown plot type: %s" % plot)
+        if args.sketch and plot in SERIES_PLOTS:
+            raise Exception("plot type %s is not available with --sketch" % plot)
+
+if not 0 < args.sketch_error < 1:
+    raise Exception("--sketch-error must be in (0, 1)")
 
 if args.intf is not None:
     if len(args.intf.strip()) == 0:
@@ -124,35 +199,269 @@ FIXED_COLOR_MAP = {
 }
 USE_FIXED_COLOR_MAP = True
 
-pat_sched = re.compile(r'(\d+.\d+): mn_sched_switch: cpu (\d+), prev: ([^,]+), next: ([^\s]+)')
-pat_htb = re.compile(r'\[00(\d)\]\s+(\d+.\d+): mn_htb: action: ([^\s]+), link: ([^\s]+), len: ([^\s]+)')
+# Every Mininet tracepoint is named mn_*; all other lines (softirq
+# events, trace headers) are rejected by a substring test before any
+# regex is run.  The payload patterns below only ever see the text
+# after the event tag.
+EVENT_MARKER = ': mn_'
+
+pat_sched = re.compile(r'cpu (\d+), prev: ([^,]+), next: ([^\s]+)')
+pat_htb = re.compile(r'action: ([^\s,]+), link: ([^\s,]+), len: ([^\s]+)')
 
+# Event times are integer nanoseconds; see parse_time().
 SchedData = namedtuple('SchedData', ['time', 'cpu', 'prev', 'next'])
 HTBData = namedtuple('HTBData', ['cpu', 'time', 'action', 'link', 'qlen'])
-ContainerInterval = namedtuple('ContainerInterval', ['start', 'duration', 'cpu'])
-
-def avg(lst):
-    return sum(lst) * 1.0 / len(lst)
-
-def pcile(lst, x):
-    lst.sort()
-    pos = int(x * len(lst))
-    return lst[pos]
-
-def pc25(lst):
-    return pcile(lst, 0.25)
-
-def median(lst):
-    return pcile(lst, 0.5)
-
-def pc75(lst):
-    return pcile(lst, 0.75)
-
-def pc90(lst):
-    return pcile(lst, 0.9)
-
-def pc99(lst):
-    return pcile(lst, 0.99)
+# Record layout of ContainerStats.intervals; start and duration in ns.
+ContainerInterval = np.dtype([('start', np.int64),
+                              ('duration', np.int64),
+                              ('cpu', np.int32)])
+
+NSEC_PER_USEC = 10**3
+NSEC_PER_SEC = 10**9
+
+class GrowableArray:
+    """Append-only typed column.  The backing store doubles when full,
+    so appends are amortised O(1) and the data stays in one contiguous
+    NumPy array, available (without copying) as @values."""
+    def __init__(self, dtype, capacity=1024):
+        self.buf = np.empty(capacity, dtype=dtype)
+        self.n = 0
+
+    def grow(self, size):
+        capacity = len(self.buf)
+        while capacity < size:
+            capacity *= 2
+        buf = np.empty(capacity, dtype=self.buf.dtype)
+        buf[:self.n] = self.buf[:self.n]
+        self.buf = buf
+
+    def append(self, value):
+        if self.n == len(self.buf):
+            self.grow(self.n + 1)
+        self.buf[self.n] = value
+        self.n += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.buf.dtype)
+        n = self.n + len(values)
+        if n > len(self.buf):
+            self.grow(n)
+        self.buf[self.n:n] = values
+        self.n = n
+
+    @property
+    def values(self):
+        return self.buf[:self.n]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getstate__(self):
+        # Don't ship the unused tail of the buffer to other processes.
+        return {'buf': self.values.copy(), 'n': self.n}
+
+    def merge(self, other):
+        self.extend(other.values)
+
+    def mean(self):
+        return self.values.mean()
+
+class Tally:
+    """Stands in for a GrowableArray of event times in --sketch mode: it
+    counts what is appended, and keeps only the first and last values."""
+    def __init__(self, dtype=None):
+        self.n = 0
+        self.first = self.last = None
+
+    def append(self, value):
+        if not self.n:
+            self.first = value
+        self.last = value
+        self.n += 1
+
+    def extend(self, values):
+        if len(values):
+            if not self.n:
+                self.first = values[0]
+            self.last = values[-1]
+            self.n += len(values)
+
+    def merge(self, other):
+        if other.n:
+            if not self.n:
+                self.first = other.first
+            self.last = other.last
+            self.n += other.n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if self.n and i == 0:
+            return self.first
+        if self.n and i == -1:
+            return self.last
+        raise IndexError(i)
+
+class QuantileSketch:
+    """Bounded-memory summary of a distribution of non-negative samples,
+    in the style of DDSketch: sample v > 0 is counted in bucket
+    ceil(log_gamma(v)), gamma = (1 + err) / (1 - err), so every quantile
+    it reports is within a relative error @err of the true one.  The
+    number of buckets grows only with log(max / min), not with the
+    number of samples."""
+    def __init__(self, err=0.01):
+        self.err = err
+        self.log_gamma = math.log((1 + err) / (1 - err))
+        self.counts = np.zeros(64, dtype=np.int64)  # by bucket
+        self.zeros = 0
+        self.n = 0
+        self.sum = 0
+        self.min = self.max = None
+
+    def grow(self, size):
+        if size > len(self.counts):
+            counts = np.zeros(max(size, 2 * len(self.counts)), dtype=np.int64)
+            counts[:len(self.counts)] = self.counts
+            self.counts = counts
+
+    def append(self, value):
+        if value > 0:
+            k = int(math.ceil(math.log(value) / self.log_gamma))
+            self.grow(k + 1)
+            self.counts[k] += 1
+        else:
+            self.zeros += 1
+        self.n += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def extend(self, values):
+        values = np.asarray(values)
+        if not len(values):
+            return
+        pos = values[values > 0]
+        if len(pos):
+            keys = np.ceil(np.log(pos) / self.log_gamma).astype(np.int64)
+            counts = np.bincount(keys)
+            self.grow(len(counts))
+            self.counts[:len(counts)] += counts
+        self.zeros += len(values) - len(pos)
+        self.n += len(values)
+        self.sum += values.sum()
+        lo, hi = values.min(), values.max()
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+
+    def merge(self, other):
+        assert(self.err == other.err)
+        if not other.n:
+            return
+        self.grow(len(other.counts))
+        self.counts[:len(other.counts)] += other.counts
+        self.zeros += other.zeros
+        self.n += other.n
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def __len__(self):
+        return self.n
+
+    def mean(self):
+        return self.sum * 1.0 / self.n
+
+    def buckets(self):
+        """Representative value of each non-empty bucket, in order, and
+        the running count of samples up to and including it."""
+        keys = np.flatnonzero(self.counts)
+        x = 2 * np.exp(keys * self.log_gamma) / (1 + math.exp(self.log_gamma))
+        counts = self.counts[keys]
+        if self.zeros:
+            x = np.concatenate(([0.0], x))
+            counts = np.concatenate(([self.zeros], counts))
+        return np.clip(x, self.min, self.max), np.cumsum(counts)
+
+    def cdf(self):
+        """(x, y) steps of the CDF: the fraction y of samples <= x."""
+        x, cum = self.buckets()
+        return x, cum * 1.0 / self.n
+
+    def quantile(self, q):
+        """The sample of rank int(q * n) in sorted order, to within the
+        relative error bound."""
+        x, cum = self.buckets()
+        rank = min(int(q * self.n), self.n - 1)
+        return x[np.searchsorted(cum, rank, 'right')]
+
+    def box_stats(self, label, scale=1.0):
+        """Stats for Axes.bxp(), as plt.boxplot() would compute them
+        from the raw samples (whiskers at 1.5 IQR, no fliers)."""
+        q1, med, q3 = [self.quantile(q) for q in (0.25, 0.5, 0.75)]
+        x, _ = self.buckets()
+        iqr = q3 - q1
+        whislo = x[x >= q1 - 1.5 * iqr].min()
+        whishi = x[x <= q3 + 1.5 * iqr].max()
+        return dict(label=label, med=med * scale, q1=q1 * scale, q3=q3 * scale,
+                    whislo=whislo * scale, whishi=whishi * scale,
+                    mean=self.mean() * scale, fliers=[])
+
+def sample_column():
+    """Column for a distribution of int64 samples (in us)."""
+    if args.sketch:
+        return QuantileSketch(args.sketch_error)
+    return GrowableArray(np.int64)
+
+def series_column(dtype):
+    """Column for a time series of @dtype records."""
+    if args.sketch:
+        return Tally(dtype)
+    return GrowableArray(dtype)
+
+class Interner:
+    """Maps names (links, containers, actions) to small integer ids, so
+    that they can be stored in the numeric columns of the event cache."""
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __call__(self, name):
+        id = self.ids.get(name)
+        if id is None:
+            id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return id
+
+class StatsTable(dict):
+    """Like defaultdict, but the missing key is passed to @factory, so
+    that stats objects know their own name."""
+    def __init__(self, factory):
+        dict.__init__(self)
+        self.factory = factory
+
+    def __missing__(self, key):
+        value = self[key] = self.factory(key)
+        return value
+
+# Statistics plotted for each window, as (label, percentile); a
+# percentile of None means the mean.
+WINDOW_STATS = [('pc25', 0.25),
+                ('median', 0.5),
+                ('mean', None),
+                ('pc75', 0.75),
+                ('pc90', 0.9)]
 
 """
 Use this class for plotting statistics for every time-bucket that is
@@ -160,58 +469,66 @@ window_sec long.  See example for LinkStats on how to plot this.
 """
 class WindowStats:
     def __init__(self, window_sec=0.01, name="Samples"):
-        self.data = []
-        self.first = None
-        self.start_time = None
         self.name = name
-        self.plot_data_x = []
-        self.plot_data_y = []
         self.window = window_sec
+        self.times = GrowableArray(np.int64)  # ns
+        self.data = GrowableArray(np.float64)
 
     def insert(self, time, value):
-        """Insert @event into our sliding window.  Assume that events
-        are inserted sorted by @event.time"""
-        if self.first is None:
-            self.first = time
-        if self.start_time is None:
-            self.start_time = time
-        if time - self.first > self.window:
-            # Window has elapsed
-            self.plot_data_y.append(self.data)
-            start = args.start
-            if start is None:
-                start = 0.0
-            self.plot_data_x.append(start + (time - self.start_time))
-            self.data = []
-            self.first = time
+        """Insert a sample taken at @time (ns)."""
+        self.times.append(time)
         self.data.append(value)
 
+    def extend(self, times, values):
+        self.times.extend(times)
+        self.data.extend(values)
+
+    def compute(self):
+        """Bucket the samples into window_sec windows, starting at the
+        first sample, and return (x, ys): the end time (s) of each
+        non-empty window, and a dict mapping each WINDOW_STATS label to
+        that statistic for each window.
+
+        The samples are sorted once by (window, value); each percentile
+        is then a single gather at the right offset into every window,
+        so all of them together cost O(n log n)."""
+        times, values = self.times.values, self.data.values
+        if not len(times):
+            return np.zeros(0), dict((label, np.zeros(0)) for label, _ in WINDOW_STATS)
+        window_ns = to_ns(self.window)
+        win = (times - times.min()) // window_ns
+        counts = np.bincount(win)
+        offsets = np.cumsum(counts) - counts
+        nonempty = np.flatnonzero(counts)
+        counts, offsets = counts[nonempty], offsets[nonempty]
+        ordered = values[np.lexsort((values, win))]
+
+        ys = {}
+        for label, pc in WINDOW_STATS:
+            if pc is None:
+                sums = np.bincount(win, weights=values)[nonempty]
+                ys[label] = sums / counts
+            else:
+                ys[label] = ordered[offsets + (pc * counts).astype(np.int64)]
+        start = args.start
+        if start is None:
+            start = 0.0
+        x = start + (nonempty + 1) * self.window
+        return x, ys
+
     def save(self, outfile, **kwargs):
         opts = dict(lw=2, xlabel='X',
                     ylabel='Y', title='title')
 
-        fun_names = ['pc25',
-                     'median',
-                     'mean',
-                     'pc75',
-                     'pc90']
-
-        funs = dict(pc25=pc25,
-                    median=median,
-                    mean=avg,
-                    pc75=pc75,
-                    pc90=pc90)
-
         opts.update(kwargs)
 
+        x, ys = self.compute()
         width = 24
         fig = plt.figure(figsize=(width, 8))
-        for name in fun_names:
-            fun = funs[name]
-            plt.plot(self.plot_data_x,
-                     map(fun, self.plot_data_y),
+        for label, _ in WINDOW_STATS:
+            plt.plot(x, ys[label],
                      lw=opts['lw'],
-                     label=name)
+                     label=label)
 
         plt.xlabel(opts['xlabel'])
         plt.ylabel(opts['ylabel'])
@@ -231,57 +548,95 @@ class WindowStats:
         plt.savefig(outfile)
 
 class LinkStats:
-    def __init__(self):
+    def __init__(self, name=''):
+        self.name = name
+        self.first_dequeue = None
         self.last_dequeue = None
-        self.inter_dequeues = []
-        self.inter_dequeues_timestamp = []
+        self.inter_dequeues = sample_column()
+        self.inter_dequeues_timestamp = series_column(np.int64)
         self.inter_dequeues_units = 'us'
-        self.dequeues = []  # times of dequeues.
-        self.enqueues = []  # times of enqueues
+        self.dequeues = series_column(np.int64)  # times of dequeues (ns).
+        self.enqueues = series_column(np.int64)  # times of enqueues (ns)
+        # Queue length after every enqueue and dequeue.
+        self.qlen = series_column(np.int32)
+        self.qlen_timestamp = series_column(np.int64)
+        self.qlen_units = 'packets'
 
     def dequeue(self, htbdata):
         if self.last_dequeue is None:
-            self.last_dequeue = htbdata.time
+            self.first_dequeue = self.last_dequeue = htbdata.time
             return
 
         delta = del_us(htbdata.time, self.last_dequeue)
         self.inter_dequeues.append(delta)
-        self.inter_dequeues_timestamp.append(float(htbdata.time))
+        self.inter_dequeues_timestamp.append(htbdata.time)
         self.last_dequeue = htbdata.time
-        self.dequeues.append(float(htbdata.time))
+        self.dequeues.append(htbdata.time)
 
     def enqueue(self, htbdata):
-        self.enqueues.append(float(htbdata.time))
+        self.enqueues.append(htbdata.time)
+
+    def queue(self, htbdata):
+        """Record the queue length after an enqueue or dequeue: both
+        events carry it as len."""
+        self.qlen.append(htbdata.qlen)
+        self.qlen_timestamp.append(htbdata.time)
+
+    def merge(self, other):
+        """Append @other, the stats for this link over the stretch of
+        trace that follows ours."""
+        self.enqueues.merge(other.enqueues)
+        self.qlen.merge(other.qlen)
+        self.qlen_timestamp.merge(other.qlen_timestamp)
+        if other.first_dequeue is None:
+            return
+        if self.last_dequeue is None:
+            self.first_dequeue = other.first_dequeue
+        else:
+            # The first dequeue in @other pairs up with our last one.
+            t = other.first_dequeue
+            self.inter_dequeues.append(del_us(t, self.last_dequeue))
+            self.inter_dequeues_timestamp.append(t)
+            self.dequeues.append(t)
+        self.inter_dequeues.merge(other.inter_dequeues)
+        self.inter_dequeues_timestamp.merge(other.inter_dequeues_timestamp)
+        self.dequeues.merge(other.dequeues)
+        self.last_dequeue = other.last_dequeue
 
     def summary(self):
         print '      Enqueues: %i' % len(self.enqueues)
         print '      Dequeues: %i' % len(self.dequeues)
         print 'Inter-Dequeues: %i' % len(self.inter_dequeues)
         if self.dequeues:
-            print 'First Dequeue: %0.3f' % self.dequeues[0]
-            print 'Last Dequeue: %0.3f' % self.dequeues[-1]
+            print 'First Dequeue: %0.3f' % seconds(self.dequeues[0])
+            print 'Last Dequeue: %0.3f' % seconds(self.dequeues[-1])
         if self.enqueues:
-            print 'First Enqueue: %0.3f' % self.enqueues[0]
-            print 'Last Enqueue: %0.3f' % self.enqueues[-1]
+            print 'First Enqueue: %0.3f' % seconds(self.enqueues[0])
+            print 'Last Enqueue: %0.3f' % seconds(self.enqueues[-1])
         print ''
 
 class ContainerStats:
-    def __init__(self):
+    def __init__(self, name=''):
         # Stats
-        self.exectimes = []  # List of scheduled-in durations
-        self.latency = []  # List of gaps between sched-out and next sched-in
-        self.intervals = []  # List of ContainerInterval objects
+        self.exectimes = sample_column()  # Scheduled-in durations
+        self.latency = sample_column()  # Gaps between sched-out and next sched-in
+        self.intervals = series_column(ContainerInterval)
 
         # State updated for each SchedData entry processed
         self.last_descheduled = None
         self.start_time = None
-        self.name = ''
+        self.name = name
         self.cpu = None
+        # ('in' | 'out', SchedData) for the first event seen; used by
+        # merge() to stitch intervals across chunk boundaries.
+        self.first_event = None
 
     def schedule_in(self, sched_data):
         if self.name == '':
             self.name = sched_data.next
         assert(self.name == sched_data.next)
+        if self.first_event is None:
+            self.first_event = ('in', sched_data)
 
         if self.last_descheduled != None:
             latency = del_us(sched_data.time, self.last_descheduled)
@@ -309,24 +664,51 @@ class ContainerStats:
             assert(self.name == sched_data.prev)
         else:
             self.name = sched_data.prev
+        if self.first_event is None:
+            self.first_event = ('out', sched_data)
 
         if self.start_time is not None:
-            exectime_us = del_us(sched_data.time, self.start_time)
-            self.exectimes.append(exectime_us)
-            pi = ContainerInterval(start = float(self.start_time),
-                                 duration = exectime_us * 1.0e-6,
-                                 cpu = sched_data.cpu)
-            self.intervals.append(pi)
+            self.close_interval(sched_data)
 
         self.last_descheduled = sched_data.time
         self.start_time = None
 
+    def close_interval(self, sched_data):
+        exectime_us = del_us(sched_data.time, self.start_time)
+        self.exectimes.append(exectime_us)
+        self.intervals.append((self.start_time,
+                               sched_data.time - self.start_time,
+                               sched_data.cpu))
+
+    def merge(self, other):
+        """Append @other, the stats for this container over the stretch
+        of trace that follows ours."""
+        if other.first_event is None:
+            return
+        kind, first = other.first_event
+        if self.first_event is None:
+            self.first_event = other.first_event
+        # @other could not account for its first event, as it lacked
+        # the state (start_time/last_descheduled) we hold.
+        if kind == 'in' and self.last_descheduled is not None:
+            self.latency.append(del_us(first.time, self.last_descheduled))
+        elif kind == 'out' and self.start_time is not None:
+            self.close_interval(first)
+        self.exectimes.merge(other.exectimes)
+        self.latency.merge(other.latency)
+        self.intervals.merge(other.intervals)
+
+        if other.last_descheduled is not None:
+            self.last_descheduled = other.last_descheduled
+        self.start_time = other.start_time
+        self.cpu = other.cpu
+
     def summary(self):
         if self.exectimes:
-            avg_exectime_us = avg(self.exectimes)
+            avg_exectime_us = self.exectimes.mean()
             print '     Execution time:   %5.3f us' % (avg_exectime_us)
         if self.latency:
-            avg_latency_us = avg(self.latency)
+            avg_latency_us = self.latency.mean()
             print '            Latency:   %5.3f us' % (avg_latency_us)
         if self.intervals:
             print '      Num Intervals:   %i' % len(self.intervals)
@@ -337,7 +719,7 @@ class CPUStats:
         self.cpu = None
         self.current_container = ''
         # Dict of container names to ContainerStats objects
-        self.container_stats = defaultdict(ContainerStats)
+        self.container_stats = StatsTable(ContainerStats)
 
     def insert(self, sched_data):
         if self.cpu is None:
@@ -350,6 +732,12 @@ class CPUStats:
         self.container_stats[sched_data.prev].schedule_out(sched_data)
         self.container_stats[sched_data.next].schedule_in(sched_data)
 
+    def merge(self, other):
+        if self.cpu is None:
+            self.cpu = other.cpu
+        for name, stats in other.container_stats.iteritems():
+            self.container_stats[name].merge(stats)
+
     def summary(self):
         containers = self.container_stats.keys()
         containers.sort()
@@ -368,34 +756,389 @@ class CPUStats:
             ret[k] = getattr(self.container_stats[k], prop)
         return ret
 
-def parse_sched(line):
-    m = pat_sched.search(line)
+def parse_sched(cpu, time, payload):
+    m = pat_sched.match(payload)
     if not m:
         return None
-    return SchedData(time=m.group(1),
-                     cpu=m.group(2),
-                     prev=m.group(3),
-                     next=m.group(4))
+    return SchedData(time=time,
+                     cpu=int(m.group(1)),
+                     prev=m.group(2),
+                     next=m.group(3))
 
-def parse_htb(line):
-    m = pat_htb.search(line)
+def parse_htb(cpu, time, payload):
+    m = pat_htb.match(payload)
     if not m:
         return None
-    return HTBData(cpu=m.group(1),
-                   time=m.group(2),
-                   action=m.group(3),
-                   link=m.group(4),
-                   qlen=m.group(5))
+    return HTBData(cpu=cpu,
+                   time=time,
+                   action=m.group(1),
+                   link=m.group(2),
+                   qlen=int(m.group(3)))
+
+# Event tag => payload decoder.
+DECODERS = {
+    'mn_sched_switch': parse_sched,
+    'mn_htb': parse_htb,
+}
 
-def del_us(t1, t2):
-    sec1, usec1 = map(int, t1.split('.'))
-    sec2, usec2 = map(int, t2.split('.'))
+def decode(line):
+    """Decode one ftrace line into a SchedData/HTBData record, or
+    return None if it is not a Mininet event."""
+    pos = line.find(EVENT_MARKER)
+    if pos < 0:
+        return None
+    tag_end = line.find(':', pos + 2)
+    decoder = DECODERS.get(line[pos + 2:tag_end])
+    if decoder is None:
+        return None
+    # Header looks like "  <task>-<pid>  [001]  1234.567890"
+    head = line[:pos]
+    time = parse_time(head[head.rfind(' ') + 1:])
+    cpu = int(head[head.rfind('[') + 1:head.rfind(']')])
+    return decoder(cpu, time, line[tag_end + 2:])
+
+class TraceReader:
+    """Streams typed records out of an ftrace dump in a single pass.
+    Only lines starting in the byte range [@begin, @end) are read;
+    @begin must be the start of a line.  @lineno is the number of lines
+    consumed so far, including lines that did not decode to an event."""
+    def __init__(self, fname, max_lines=0, begin=0, end=None):
+        self.fname = fname
+        self.max_lines = max_lines
+        self.begin = begin
+        self.end = end
+        self.lineno = 0
+
+    def __iter__(self):
+        max_lines = self.max_lines
+        f = open(self.fname)
+        f.seek(self.begin)
+        pos, end = self.begin, self.end
+        for line in f:
+            if end is not None:
+                if pos >= end:
+                    break
+                pos += len(line)
+            self.lineno += 1
+            # End early if samples param given at command line.
+            if max_lines and self.lineno >= max_lines:
+                break
+            if EVENT_MARKER not in line:
+                continue
+            event = decode(line)
+            if event is not None:
+                yield event
+
+class FollowReader:
+    """Like TraceReader, but follows a file as it is written to, or
+    reads a FIFO or pipe (such as trace_pipe) until its writer closes
+    it.  Whenever no complete line arrives within @poll seconds, it
+    yields None, so that the caller can do periodic work while the
+    trace is idle."""
+    def __init__(self, fname, poll=0.05):
+        self.fname = fname
+        self.poll = poll
+        self.lineno = 0
+
+    def __iter__(self):
+        if self.fname == '-':
+            fd = sys.stdin.fileno()
+        else:
+            fd = os.open(self.fname, os.O_RDONLY)
+        # A regular file never hits EOF for good; it may still grow.
+        pipe = not stat.S_ISREG(os.fstat(fd).st_mode)
+        partial = ''
+        while True:
+            if pipe and not select.select([fd], [], [], self.poll)[0]:
+                yield None
+                continue
+            data = os.read(fd, 1 << 16)
+            if not data:
+                if pipe:
+                    break
+                time.sleep(self.poll)
+                yield None
+                continue
+            lines = (partial + data).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                self.lineno += 1
+                if EVENT_MARKER not in line:
+                    continue
+                event = decode(line)
+                if event is not None:
+                    yield event
 
-    return abs((sec2 - sec1) * 10**6 + (usec2 - usec1))
+def parse_time(ts):
+    """Convert an ftrace timestamp ("1234.567890") to integer ns.  This
+    is done once per event; all later arithmetic is on integers."""
+    sec, _, frac = ts.partition('.')
+    return int(sec) * NSEC_PER_SEC + int((frac + '000000000')[:9])
 
-def parse(f, args):
+def seconds(ns):
+    return ns * 1.0 / NSEC_PER_SEC
+
+def to_ns(sec):
+    if sec is None:
+        return None
+    return int(round(sec * NSEC_PER_SEC))
 
-    def in_range(time_val, start, end, duration, start_time=0.0):
+def del_us(t1, t2):
+    return abs(t1 - t2) // NSEC_PER_USEC
+
+# The index records the first event at or after every INDEX_STRIDE bytes
+# of the trace, as rows of (time_ns, byte offset, line number).
+INDEX_STRIDE = 1 << 16
+INDEX_VERSION = 1
+
+def index_path(fname):
+    return fname + '.idx'
+
+def build_index(fname):
+    size = os.path.getsize(fname)
+    if size == 0:
+        return np.zeros((0, 3), dtype=np.int64)
+    f = open(fname, 'rb')
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    entries = []
+    pos = 0
+    lineno, counted = 0, 0
+    for target in xrange(0, size, INDEX_STRIDE):
+        if target < pos:
+            # The previous entry's event lies past this stride.
+            continue
+        if target > 0:
+            # Start of the first line at or after target.
+            pos = mm.find('\n', target - 1) + 1
+            if pos == 0:
+                break
+        event = None
+        while pos < size:
+            line_end = mm.find('\n', pos) + 1 or size
+            line = mm[pos:line_end]
+            if EVENT_MARKER in line:
+                event = decode(line)
+                if event is not None:
+                    break
+            pos = line_end
+        if event is None:
+            break
+        lineno += mm[counted:pos].count('\n')
+        counted = pos
+        entries.append((event.time, pos, lineno))
+        pos = line_end
+    mm.close()
+    return np.array(entries, dtype=np.int64).reshape((-1, 3))
+
+def save_atomic(path, write):
+    """Call @write with a file open for writing, then move the file
+    to @path, so that an interrupted run never leaves a partial file
+    at @path."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                               prefix=os.path.basename(path) + '.')
+    umask = os.umask(0)
+    os.umask(umask)
+    try:
+        # mkstemp makes files private; make it like any other output.
+        os.chmod(tmp, 0666 & ~umask)
+        f = os.fdopen(fd, 'wb')
+        try:
+            write(f)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+def load_index(fname):
+    """Return the index for @fname, from the cached FILE.idx if it is
+    still valid for the trace's size and mtime; otherwise rebuild it
+    and try to cache it next to the trace."""
+    st = os.stat(fname)
+    path = index_path(fname)
+    try:
+        # np.load complains noisily about files that are not zips.
+        if not zipfile.is_zipfile(path):
+            raise IOError('not a saved index')
+        saved = np.load(path)
+        try:
+            if (saved['version'] == INDEX_VERSION and
+                saved['size'] == st.st_size and
+                saved['mtime'] == st.st_mtime):
+                return saved['index']
+        finally:
+            saved.close()
+    except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile):
+        # Missing, stale or corrupt: rebuild it.
+        pass
+    print 'Building trace index %s' % path
+    index = build_index(fname)
+    try:
+        save_atomic(path, lambda f: np.savez(f, index=index,
+                                             version=INDEX_VERSION,
+                                             size=st.st_size,
+                                             mtime=st.st_mtime))
+    except (IOError, OSError), e:
+        print 'WARNING: could not save trace index: %s' % e
+    return index
+
+def window_range(index, size, t0, t1):
+    """Return (begin, end, lineno): a line-aligned byte range that holds
+    every event with absolute time in [@t0, @t1] (@t1 None for the end
+    of the trace), and the number of lines before @begin."""
+    if not len(index):
+        return 0, size, 0
+    # Events are only roughly sorted across CPUs, so search on the
+    # running maximum and leave one extra stride of slack at each end.
+    times = np.maximum.accumulate(index[:, 0])
+    i = np.searchsorted(times, t0, 'left') - 2
+    begin, lineno = 0, 0
+    if i >= 0:
+        begin, lineno = int(index[i, 1]), int(index[i, 2])
+    end = size
+    if t1 is not None:
+        j = np.searchsorted(times, t1, 'right') + 1
+        if j < len(index):
+            end = int(index[j, 1])
+    return begin, end, lineno
+
+# Decoded events are cached next to the trace as one fixed-size record
+# per event (FILE.cache.npy), plus a JSON sidecar holding the name
+# tables and the trace size/mtime the cache is valid for.  Link,
+# container and action names are stored as indices into those tables;
+# a and b hold (prev, next) for sched events and (link, qlen) for htb.
+EVENT_SCHED, EVENT_HTB = 0, 1
+CachedEvent = np.dtype([('time', np.int64),
+                        ('type', np.int8),
+                        ('action', np.int8),
+                        ('cpu', np.int16),
+                        ('a', np.int32),
+                        ('b', np.int32),
+                        ('line', np.int32)])
+CACHE_VERSION = 1
+# Cached events are turned back into records this many at a time.
+CACHE_BLOCK = 1 << 16
+
+def cache_paths(fname):
+    return fname + '.cache.npy', fname + '.cache.json'
+
+def decode_chunk(chunk):
+    """Decode the byte range [begin, end) of a trace into CachedEvent
+    records.  Returns (events, lines, names), where names holds this
+    chunk's link, container and action name tables."""
+    fname, begin, end = chunk
+    links, containers, actions = Interner(), Interner(), Interner()
+    events = GrowableArray(CachedEvent, capacity=1 << 16)
+    reader = TraceReader(fname, begin=begin, end=end)
+    for event in reader:
+        if type(event) is HTBData:
+            events.append((event.time, EVENT_HTB, actions(event.action),
+                           event.cpu, links(event.link), event.qlen,
+                           reader.lineno))
+        else:
+            events.append((event.time, EVENT_SCHED, 0, event.cpu,
+                           containers(event.prev), containers(event.next),
+                           reader.lineno))
+    names = dict(links=links.names, containers=containers.names,
+                 actions=actions.names)
+    return events.values, reader.lineno, names
+
+def build_cache(fname, jobs=1):
+    """Decode all of @fname (in @jobs processes) and save the cache."""
+    st = os.stat(fname)
+    chunks = [(fname, begin, end) for begin, end in split_chunks(fname, jobs)]
+    if jobs > 1:
+        pool = Pool(jobs)
+        parts = pool.imap(decode_chunk, chunks)
+    else:
+        parts = itertools.imap(decode_chunk, chunks)
+
+    tables = dict(links=Interner(), containers=Interner(), actions=Interner())
+    events = GrowableArray(CachedEvent)
+    lines = 0
+    for part_events, part_lines, part_names in parts:
+        # Renumber names and lines from chunk-local to trace-wide.
+        remap = dict((k, np.array(map(tables[k], part_names[k]) or [0]))
+                     for k in tables)
+        htb = part_events['type'] == EVENT_HTB
+        sched = ~htb
+        part_events['action'][htb] = remap['actions'][part_events['action'][htb]]
+        part_events['a'][htb] = remap['links'][part_events['a'][htb]]
+        for col in ('a', 'b'):
+            part_events[col][sched] = remap['containers'][part_events[col][sched]]
+        part_events['line'] += lines
+        events.extend(part_events)
+        lines += part_lines
+    if jobs > 1:
+        pool.terminate()
+
+    meta = dict(version=CACHE_VERSION, size=st.st_size, mtime=st.st_mtime,
+                events=len(events), lines=lines,
+                links=tables['links'].names,
+                containers=tables['containers'].names,
+                actions=tables['actions'].names)
+    npy, js = cache_paths(fname)
+    try:
+        save_atomic(npy, lambda f: np.save(f, events.values))
+        # Written last: its presence marks a complete cache.
+        save_atomic(js, lambda f: json.dump(meta, f))
+    except (IOError, OSError), e:
+        print 'WARNING: could not save event cache: %s' % e
+    return events.values, meta
+
+def load_cache(fname):
+    """Return (events, meta) from the event cache of @fname, with the
+    events memory-mapped, or None if there is no valid cache."""
+    st = os.stat(fname)
+    npy, js = cache_paths(fname)
+    try:
+        meta = json.load(open(js))
+        if (meta['version'] != CACHE_VERSION or meta['size'] != st.st_size
+            or meta['mtime'] != st.st_mtime):
+            return None
+        events = np.load(npy, mmap_mode='r')
+        if events.dtype != CachedEvent or len(events) != meta['events']:
+            return None
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+    return events, meta
+
+class CacheReader:
+    """Like TraceReader, but replays the events of a loaded event cache."""
+    def __init__(self, cache, max_lines=0):
+        self.events, self.meta = cache
+        self.max_lines = max_lines
+        self.lineno = 0
+
+    def __iter__(self):
+        links = self.meta['links']
+        containers = self.meta['containers']
+        actions = self.meta['actions']
+        max_lines = self.max_lines
+        for i in xrange(0, len(self.events), CACHE_BLOCK):
+            block = self.events[i:i + CACHE_BLOCK]
+            columns = [block[k].tolist() for k in CachedEvent.names]
+            for time, kind, action, cpu, a, b, line in itertools.izip(*columns):
+                self.lineno = line
+                if max_lines and line >= max_lines:
+                    self.lineno = max_lines
+                    return
+                if kind == EVENT_HTB:
+                    yield HTBData(cpu=cpu, time=time, action=actions[action],
+                                  link=links[a], qlen=b)
+                else:
+                    yield SchedData(time=time, cpu=cpu,
+                                    prev=containers[a], next=containers[b])
+        self.lineno = self.meta['lines']
+
+def scan(reader, args, start_time=None):
+    """Feed the events from @reader into fresh stats objects.  Times
+    are taken relative to @start_time, or to the first event if None.
+    Returns (stats, linkstats, ignored_linenos, stopped); stopped is
+    True if the scan ended early because it ran past the window."""
+
+    def in_range(time_val, start, end, duration, start_time=0):
         """Return True if time is within range.
 
         If nothing is specified, filter nothing.
@@ -417,62 +1160,370 @@ def parse(f, args):
                 return False
         return True
 
-    stats = defaultdict(CPUStats)
-    linkstats = defaultdict(LinkStats)
-    start_time = None
+    start, end, duration = map(to_ns, (args.start, args.end, args.duration))
 
-    lineno = 0
+    stats = defaultdict(CPUStats)
+    linkstats = StatsTable(LinkStats)
     ignored_linenos = []
+    stopped = False
+    # Queue lengths cost a record per event; keep them only to plot.
+    track_qlen = 'qlen' in args.plots
 
-    if args.absolute:
-        start_time = 0.0
-
-    for l in open(f).xreadlines():
-        lineno += 1
-        # End early if samples param given at command line.
-        if args.samples and lineno >= args.samples:
-            break
-
-        sched = parse_sched(l)
-        htb = parse_htb(l)
-
+    for event in reader:
         if start_time is None:
-            if htb:
-                start_time = float(htb.time)
-            elif sched:
-                start_time = float(sched.time)
+            start_time = event.time
 
         try:
-            if htb:
+            if type(event) is HTBData:
+                htb = event
                 if args.intf and htb.link not in args.intf:
                     continue
-                htb_time = float(htb.time)
-                if in_range(htb_time, args.start, args.end, args.duration, start_time):
-                    if htb.action == 'dequeue' and int(htb.qlen) > 0:
+                htb_time = htb.time
+                if in_range(htb_time, start, end, duration, start_time):
+                    if track_qlen and htb.action in ('enqueue', 'dequeue'):
+                        linkstats[htb.link].queue(htb)
+                    if htb.action == 'dequeue' and htb.qlen > 0:
                         linkstats[htb.link].dequeue(htb)
                     elif htb.action == 'enqueue':
                         linkstats[htb.link].enqueue(htb)
-                elif args.end and (htb_time - start_time > args.end):
+                elif end and (htb_time - start_time > end):
+                    stopped = True
                     break
-                elif args.duration and (htb_time - start_time > (args.start + args.duration)):
+                elif duration and (htb_time - start_time > (start + duration)):
+                    stopped = True
                     break
 
-            if sched:
-                sched_time = float(sched.time)
-                if in_range(sched_time, args.start, args.end, args.duration, start_time):
+            else:
+                sched = event
+                sched_time = sched.time
+                if in_range(sched_time, start, end, duration, start_time):
                     stats[sched.cpu].insert(sched)
-                elif args.end and (sched_time - start_time> args.end):
+                elif end and (sched_time - start_time > end):
+                    stopped = True
                     break
-                elif args.duration and (sched_time - start_time > (args.start + args.duration)):
+                elif duration and (sched_time - start_time > (start + duration)):
+                    stopped = True
                     break
 
         except:
-            ignored_linenos.append(lineno)
+            ignored_linenos.append(reader.lineno)
+
+    return stats, linkstats, ignored_linenos, stopped
+
+def split_chunks(fname, n, begin=0, end=None):
+    """Split the line-aligned range [@begin, @end) of @fname into at most
+    @n (begin, end) byte ranges, each of which starts at the beginning
+    of a line."""
+    if end is None:
+        end = os.path.getsize(fname)
+    f = open(fname)
+    offsets = [begin]
+    for i in xrange(1, n):
+        f.seek(begin + (end - begin) * i // n)
+        f.readline()
+        pos = f.tell()
+        if offsets[-1] < pos < end:
+            offsets.append(pos)
+    offsets.append(end)
+    return zip(offsets[:-1], offsets[1:])
+
+def parse_chunk(chunk):
+    """Worker for parse_parallel(): scan one byte range of the trace."""
+    fname, begin, end, start_time = chunk
+    reader = TraceReader(fname, begin=begin, end=end)
+    stats, linkstats, ignored_linenos, stopped = scan(reader, args, start_time)
+    return stats, linkstats, reader.lineno, ignored_linenos, stopped
+
+def parse_parallel(f, args, start_time, begin=0, end=None):
+    """Scan @f in args.jobs chunks in a process pool, and merge the
+    per-chunk stats in file order.  Each chunk's stats carry enough
+    boundary state (see the merge() methods) to stitch the inter-dequeue
+    and scheduling intervals that straddle chunk boundaries."""
+    if start_time is None:
+        # Times are relative to the first event in the whole trace.
+        for event in TraceReader(f):
+            start_time = event.time
+            break
+
+    stats = defaultdict(CPUStats)
+    linkstats = StatsTable(LinkStats)
+    lineno = 0
+    ignored_linenos = []
+
+    chunks = [(f, begin, end, start_time)
+              for begin, end in split_chunks(f, args.jobs, begin, end)]
+    pool = Pool(args.jobs)
+    for part in pool.imap(parse_chunk, chunks):
+        part_stats, part_linkstats, nlines, part_ignored, stopped = part
+        for cpu in sorted(part_stats.keys()):
+            stats[cpu].merge(part_stats[cpu])
+        for link in sorted(part_linkstats.keys()):
+            linkstats[link].merge(part_linkstats[link])
+        ignored_linenos.extend([lineno + n for n in part_ignored])
+        lineno += nlines
+        if stopped:
+            break
+    pool.terminate()
+    return stats, linkstats, lineno, ignored_linenos
+
+def window(args, start_time):
+    """Absolute (t0, t1) ns bounds of the requested window; t1 is None
+    if the window runs to the end of the trace."""
+    t1 = None
+    if args.end is not None:
+        t1 = start_time + to_ns(args.end)
+    if args.duration is not None and args.start is not None:
+        t = start_time + to_ns(args.start + args.duration)
+        t1 = t if t1 is None else min(t1, t)
+    return start_time + to_ns(args.start or 0), t1
+
+def group_starts(keys):
+    """Start index of each run of equal rows in the sorted @keys."""
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[0] = True
+    for k in keys:
+        change[1:] |= k[1:] != k[:-1]
+    return np.flatnonzero(change)
+
+def scan_cached(cache, args, start_time=None):
+    """Vectorised equivalent of scan(CacheReader(cache), ...): builds the
+    same stats from whole columns of the event cache, rather than
+    replaying events one at a time.  Returns (stats, linkstats, lineno)."""
+    events, meta = cache
+    stats = defaultdict(CPUStats)
+    linkstats = StatsTable(LinkStats)
+    if not len(events):
+        return stats, linkstats, meta['lines']
+
+    time = np.asarray(events['time'])
+    kind = np.asarray(events['type'])
+    a, b = np.asarray(events['a']), np.asarray(events['b'])
+    line = np.asarray(events['line'])
+    if start_time is None:
+        start_time = int(time[0])
+    start, end, duration = map(to_ns, (args.start, args.end, args.duration))
+
+    # Per-event versions of the tests in scan().
+    rel = time - start_time
+    is_htb = kind == EVENT_HTB
+    eligible = np.ones(len(events), dtype=bool)
+    if args.intf:
+        links = [i for i, name in enumerate(meta['links']) if name in args.intf]
+        eligible = ~is_htb | np.in1d(a, links)
+    in_range = np.ones(len(events), dtype=bool)
+    past = np.zeros(len(events), dtype=bool)
+    if start is not None:
+        in_range &= rel >= start
+    if end is not None:
+        in_range &= rel <= end
+        if end:
+            past |= rel > end
+    if duration is not None:
+        in_range &= rel <= start + duration
+        if duration:
+            past |= rel > start + duration
+
+    # scan() stops at the first eligible event past the window, or at
+    # the --samples line limit (before the event on that line).
+    lineno = meta['lines']
+    n = len(events)
+    if args.samples and args.samples <= lineno:
+        lineno = args.samples
+        n = np.searchsorted(line, lineno, 'left')
+    stop = np.flatnonzero(eligible[:n] & past[:n])
+    if len(stop):
+        n = stop[0]
+        lineno = int(line[n])
+    use = eligible[:n] & in_range[:n]
+    is_htb = is_htb[:n]
+
+    # Links
+    actions = meta['actions']
+    dequeue = actions.index('dequeue') if 'dequeue' in actions else -1
+    enqueue = actions.index('enqueue') if 'enqueue' in actions else -1
+    action = np.asarray(events['action'][:n])
+    deq_all = use & is_htb & (action == dequeue)
+    deq = deq_all & (b[:n] > 0)
+    enq = use & is_htb & (action == enqueue)
+    sel = np.flatnonzero(deq_all | enq)
+    order = sel[np.argsort(a[sel], kind='mergesort')]
+    if len(order):
+        bounds = list(group_starts([a[order]])) + [len(order)]
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            idx = order[lo:hi]
+            ls = linkstats[meta['links'][a[idx[0]]]]
+            ls.enqueues.extend(time[idx[enq[idx]]])
+            if 'qlen' in args.plots:
+                ls.qlen.extend(b[idx])
+                ls.qlen_timestamp.extend(time[idx])
+            t = time[idx[deq[idx]]]
+            if len(t):
+                ls.first_dequeue, ls.last_dequeue = int(t[0]), int(t[-1])
+                ls.inter_dequeues.extend(np.abs(np.diff(t)) // NSEC_PER_USEC)
+                ls.inter_dequeues_timestamp.extend(t[1:])
+                ls.dequeues.extend(t[1:])
+
+    # Containers: each sched event is a schedule_out of prev followed by
+    # a schedule_in of next.  Lay these out as one sequence per (cpu,
+    # container), in event order.
+    sel = np.flatnonzero(use & ~is_htb)
+    if not len(sel):
+        return stats, linkstats, lineno
+    cpu = np.asarray(events['cpu'][sel]).repeat(2)
+    name = np.empty(2 * len(sel), dtype=np.int32)
+    name[0::2], name[1::2] = a[sel], b[sel]
+    t = time[sel].repeat(2)
+    is_in = np.tile([False, True], len(sel))
+    order = np.lexsort((np.arange(len(t)), name, cpu))
+    cpu, name, t, is_in = cpu[order], name[order], t[order], is_in[order]
+
+    starts = group_starts([cpu, name])
+    group = np.zeros(len(t), dtype=np.int64)
+    group[starts[1:]] = 1
+    group = np.cumsum(group)
+    # Exec time: an out whose predecessor in the sequence is an in.
+    closes = np.flatnonzero(~is_in[1:] & is_in[:-1] & (group[1:] == group[:-1])) + 1
+    # Latency: an in preceded (anywhere in its sequence) by an out.
+    last_out = np.maximum.accumulate(np.where(is_in, -1, np.arange(len(t))))
+    opens = np.flatnonzero(is_in & (last_out >= starts[group]))
+
+    bounds = list(starts) + [len(t)]
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        cs = stats[int(cpu[lo])].container_stats[meta['containers'][name[lo]]]
+        stats[int(cpu[lo])].cpu = cs.cpu = int(cpu[lo])
+        c = closes[np.searchsorted(closes, lo):np.searchsorted(closes, hi)]
+        durations = t[c] - t[c - 1]
+        cs.exectimes.extend(np.abs(durations) // NSEC_PER_USEC)
+        intervals = np.empty(len(c), dtype=ContainerInterval)
+        intervals['start'], intervals['duration'] = t[c - 1], durations
+        intervals['cpu'] = cs.cpu
+        cs.intervals.extend(intervals)
+        o = opens[np.searchsorted(opens, lo):np.searchsorted(opens, hi)]
+        cs.latency.extend(np.abs(t[o] - t[last_out[o]]) // NSEC_PER_USEC)
+        if last_out[hi - 1] >= lo:
+            cs.last_descheduled = int(t[last_out[hi - 1]])
+        if is_in[hi - 1]:
+            cs.start_time = int(t[hi - 1])
+    return stats, linkstats, lineno
+
+def parse_cached(cache, args, start_time):
+    """Build the stats for the requested window from the event cache."""
+    if args.duration is not None and args.start is None:
+        # scan() treats this as an error on every line; replay it as is.
+        reader = CacheReader(cache, max_lines=args.samples)
+        stats, linkstats, ignored_linenos, _ = scan(reader, args, start_time)
+        return stats, linkstats, reader.lineno, ignored_linenos
+    stats, linkstats, lineno = scan_cached(cache, args, start_time)
+    return stats, linkstats, lineno, []
+
+def follow_summary(elapsed, lineno, stats, linkstats, seen):
+    """Print the --follow summary: per-link inter-dequeue and
+    per-container latency percentiles so far, and how many samples
+    arrived since the last summary (@seen maps each column to its
+    length then, and is updated)."""
+    def line(name, col):
+        new = len(col) - seen.get(id(col), 0)
+        seen[id(col)] = len(col)
+        if not len(col):
+            return '%-24s %8d new' % (name, new)
+        pcs = ' '.join('p%d %8.0f' % (100 * q, col.quantile(q))
+                       for q in (0.5, 0.9, 0.99))
+        return '%-24s %8d new  %s  max %8d us' % (name, new, pcs, col.max)
+
+    print '-' * 80
+    print '%0.3f s, %d lines' % (elapsed, lineno)
+    for link in sorted(linkstats.keys()):
+        print line('Link %s' % link, linkstats[link].inter_dequeues)
+    for cpu in sorted(stats.keys()):
+        containers = stats[cpu].container_stats
+        for name in sorted(containers.keys()):
+            print line('CPU %s %s' % (cpu, name), containers[name].latency)
+    sys.stdout.flush()
+
+def follow(f, args):
+    """Build the stats from @f as it is written, printing a summary
+    every args.interval_ms, until @f is closed by its writer (for a
+    FIFO) or the user hits Ctrl-C."""
+    stats = defaultdict(CPUStats)
+    linkstats = StatsTable(LinkStats)
+    ignored_linenos = []
+    seen = {}
+    reader = FollowReader(f)
+    period = args.interval_ms / 1e3
+    started = time.time()
+    due = started + period
+    try:
+        for event in reader:
+            if event is not None:
+                try:
+                    if type(event) is HTBData:
+                        if args.intf and event.link not in args.intf:
+                            pass
+                        elif event.action == 'dequeue' and event.qlen > 0:
+                            linkstats[event.link].dequeue(event)
+                        elif event.action == 'enqueue':
+                            linkstats[event.link].enqueue(event)
+                    else:
+                        stats[event.cpu].insert(event)
+                except:
+                    ignored_linenos.append(reader.lineno)
+            now = time.time()
+            if now >= due:
+                follow_summary(now - started, reader.lineno, stats, linkstats, seen)
+                due = max(due + period, now)
+    except KeyboardInterrupt:
+        pass
+    return stats, linkstats, reader.lineno, ignored_linenos
+
+def parse(f, args):
+    start_time = None
+    if args.absolute:
+        start_time = 0
+
+    # Byte range of the trace to read, and the line number it starts at.
+    begin, end, first_lineno = 0, None, 0
+    windowed = args.start is not None or args.end is not None
+
+    cache = None
+    if args.cache and not args.follow:
+        cache = load_cache(f)
+        if cache is None and not windowed and not args.samples:
+            # This run reads the whole trace anyway, so decode it once
+            # into the cache, and replay that.
+            print 'Building event cache %s' % cache_paths(f)[0]
+            cache = build_cache(f, args.jobs)
+
+    if args.follow:
+        stats, linkstats, lineno, ignored_linenos = follow(f, args)
+    elif cache is not None:
+        stats, linkstats, lineno, ignored_linenos = parse_cached(
+            cache, args, start_time)
+    else:
+        if windowed and args.index and not args.samples:
+            index = load_index(f)
+            if len(index):
+                if start_time is None:
+                    start_time = int(index[0, 0])
+                t0, t1 = window(args, start_time)
+                begin, end, first_lineno = window_range(
+                    index, os.path.getsize(f), t0, t1)
+
+        if args.jobs > 1 and not args.samples:
+            stats, linkstats, lineno, ignored_linenos = parse_parallel(
+                f, args, start_time, begin, end)
+        else:
+            reader = TraceReader(f, max_lines=args.samples, begin=begin, end=end)
+            stats, linkstats, ignored_linenos, _ = scan(reader, args, start_time)
+            lineno = reader.lineno
+    ignored_linenos = [first_lineno + n for n in ignored_linenos]
 
     def sep():
         return '-' * 80
 
-    print 'Processed %d lines.' % lineno
+    if first_lineno:
+        print 'Processed %d lines, starting at line %d.' % (lineno, first_lineno + 1)
+    else:
+        print 'Processed %d lines.' % lineno
     print 'Ignored %d lines: %s' % (len(ignored_linenos), ignored_linenos)
     for cpu in sorted(stats.keys()):
         print 'CPU: %s' % cpu
@@ -485,16 +1536,10 @@ def parse(f, args):
     return stats, linkstats
 
 def cdf(values):
-    values.sort()
-    prob = 0
-    l = len(values)
-    x, y = [], []
-
-    for v in values:
-        prob += 1.0 / l
-        x.append(v)
-        y.append(prob)
-
+    if isinstance(values, QuantileSketch):
+        return values.cdf()
+    x = np.sort(values)
+    y = np.arange(1, len(x) + 1) * 1.0 / len(x)
     return (x, y)
 
 
@@ -512,23 +1557,33 @@ def plot_link_stat(stats, prop, kind, outfile, metric, title=None):
 
     xvalues = []
     for i, link in enumerate(links):
+        values = getattr(stats[link], prop)
         if kind == 'CDF':
-            x, y = cdf(getattr(stats[link], prop))
+            x, y = cdf(values)
             plt.plot(x, y, lw=2, label=link)
             if args.logscale:
                 plt.xscale('log')
 
             if args.output_link_data:
                 f = open(args.output_link_data, 'w')
-                string = "\n".join(map(lambda val: str(val),  getattr(stats[link], prop)))
+                if args.sketch:
+                    # Only the CDF is known: write it as "value fraction".
+                    string = "\n".join('%s %s' % xy for xy in zip(x, y))
+                else:
+                    string = "\n".join(map(str, values.values.tolist()))
                 f.write(string)
                 f.close()
             plt.xlabel(metric)
+        elif args.sketch:
+            xvalues.append(values.box_stats(link))
         else:
-            xvalues.append(getattr(stats[link], prop))
+            xvalues.append(values.values)
 
     if kind == 'boxplot':
-        plt.boxplot(xvalues)
+        if args.sketch:
+            plt.gca().bxp(xvalues)
+        else:
+            plt.boxplot(xvalues)
         plt.xticks(range(1, 1+len(links)), links)
         if args.logscale:
             plt.yscale('log')
@@ -568,14 +1623,13 @@ def plot_linkstats_window(stats, prop, title='', window_sec=0.01):
         # inter_dequeues_timestamp, and its units in
         # inter_dequeues_units.  Check the class for more info.
 
-        values = getattr(stats[link], prop)
-        ts = getattr(stats[link], prop + '_timestamp')
+        values = getattr(stats[link], prop).values
+        ts = getattr(stats[link], prop + '_timestamp').values
         unit = getattr(stats[link], prop + '_units')
 
         # To start with: 10 ms window
         w = WindowStats(window_sec=window_sec)
-        for t, v in zip(ts, values):
-            w.insert(t, v)
+        w.extend(ts, values)
 
         outfile = 'link%s-prop%s-window.png' % (link, prop)
         outfile = os.path.join(args.odir, outfile)
@@ -587,6 +1641,40 @@ def plot_linkstats_window(stats, prop, title='', window_sec=0.01):
                title="%s; window=%.3fs" % (title, window_sec))
     return
 
+def window_max(times, values, window_ns):
+    """The maximum of a step function, which takes @values[i] from
+    @times[i] (ns, sorted) on, over each window_ns window, starting at
+    the first step.  Returns (x, ys): the start time (ns) of each
+    window, and the maximum over it, which includes the value carried
+    into the window from the last step before it."""
+    win = (times - times[0]) // window_ns
+    nwin = int(win[-1]) + 1
+    ys = np.zeros(nwin, dtype=values.dtype)
+    np.maximum.at(ys, win, values)
+    # The last step before each window (all windows but the first have one).
+    last = np.searchsorted(win, np.arange(1, nwin)) - 1
+    ys[1:] = np.maximum(ys[1:], values[last])
+    return times[0] + np.arange(nwin) * window_ns, ys
+
+def save_link_qlen(stats, window_sec=0.01):
+    """Write the exact queue length of each link, as reconstructed from
+    the enqueue and dequeue events, and its maximum over each
+    window_sec window, to qlen_LINK.txt and qlen_max_LINK.txt in the
+    time,packets format of monitor.QlenProbe (so util/plot_queue.py
+    can plot them)."""
+    for link in sorted(stats.keys()):
+        ts = stats[link].qlen_timestamp.values
+        if not len(ts):
+            continue
+        qlen = stats[link].qlen.values
+        x, ys = window_max(ts, qlen, to_ns(window_sec))
+        for name, t, q in [('qlen_%s.txt', ts, qlen),
+                           ('qlen_max_%s.txt', x, ys)]:
+            outfile = os.path.join(args.odir, name % link)
+            print outfile
+            np.savetxt(outfile, np.column_stack((seconds(t), q)),
+                       fmt=['%.9f', '%d'], delimiter=',')
+
 def plot_container_stat(kvs, kind, outfile, metric, title=None):
     exclude_keys = []
     keys = kvs.keys()
@@ -602,25 +1690,30 @@ def plot_container_stat(kvs, kind, outfile, metric, title=None):
         if k in exclude_keys:
             continue
 
-        ms_values = map(lambda us: us/1e3,
-                        kvs[k])
         if kind == 'CDF':
-            x, y = cdf(ms_values)
+            x, y = cdf(kvs[k])
+            x = x / 1e3
 
             hue = i*1.0/l
             plt.plot(x, y,
                      label=k,
                      lw=2,
                      color=colorsys.hls_to_rgb(hue, 0.5, 1.0))
+        elif args.sketch:
+            xvalues.append(kvs[k].box_stats(k, scale=1e-3))
+            xlabels.append(k)
         else:
-            xvalues.append(ms_values)
+            xvalues.append(kvs[k].values / 1e3)
             xlabels.append(k)
 
     plt.grid(True)
     metric += ' (ms)'
     if kind == 'boxplot':
         nx = len(xvalues)
-        plt.boxplot(xvalues)
+        if args.sketch:
+            plt.gca().bxp(xvalues)
+        else:
+            plt.boxplot(xvalues)
         plt.xticks(range(1,nx+1), xlabels)
         if args.logscale:
             plt.yscale('log')
@@ -645,85 +1738,152 @@ def plot_container_stat(kvs, kind, outfile, metric, title=None):
         plt.show()
 
 WIDTH_SCALE_FACTOR = 30  # inches of figure per second of recording.
+HISTORY_MAX_WIDTH = 24  # ... up to this many inches.
+HISTORY_DPI = 100  # The history is rasterised at one column per pixel.
+
+def occupancy(starts, ends, t0, width, nbins):
+    """Fraction of each of the @nbins bins of @width ns starting at @t0
+    that is covered by the intervals [@starts, @ends) (ns).  Each
+    interval adds its partial coverage to its first and last bins, and
+    marks the bins in between as full in a difference array, so this
+    costs O(len(starts) + nbins) however long the intervals are.
+    Overlapping intervals add up; the result is not clipped."""
+    s = np.clip(starts - t0, 0, width * nbins)
+    e = np.clip(ends - t0, 0, width * nbins)
+    keep = e > s
+    s, e = s[keep], e[keep]
+    first = s // width
+    last = (e - 1) // width
+    covered = np.zeros(nbins)
+    same = first == last
+    covered += np.bincount(first[same], weights=e[same] - s[same], minlength=nbins)
+    split = ~same
+    s, e, first, last = s[split], e[split], first[split], last[split]
+    covered += np.bincount(first, weights=(first + 1) * width - s, minlength=nbins)
+    covered += np.bincount(last, weights=e - last * width, minlength=nbins)
+    full = (np.bincount(first + 1, minlength=nbins + 1) -
+            np.bincount(last, minlength=nbins + 1))
+    covered += np.cumsum(full)[:nbins] * width
+    return covered / width
 
 def plot_scheduling_history(containerstats, linkstats, outfile, title = None, exts = ['pdf', 'png']):
+    """Plot which container ran on each CPU over time, and the enqueues
+    and dequeues on each link.  Rather than drawing every interval, the
+    history is binned into one column per pixel, shaded by how much of
+    the column each container occupies, and drawn as a single image;
+    its cost is linear in the number of events, and the image size is
+    bounded.  With --history-levels N, level k = 1..N renders the same
+    history as 2^k tiles, each binned at the full width of the figure,
+    from one occupancy image built at the finest level."""
     container_index = 0
     colors = {}  # Dict of container names to color strings
 
     if USE_FIXED_COLOR_MAP:
-        colors = FIXED_COLOR_MAP
+        colors = dict(FIXED_COLOR_MAP)
 
     # Grab the full list of containers to assign colors.
     for cpu, cpustats in containerstats.iteritems():
         for container, stats in cpustats.container_stats.iteritems():
             if container not in colors:
-                colors[container] = COLOR_LIST[container_index]
+                # Colours repeat once there are more containers than colours.
+                colors[container] = COLOR_LIST[container_index % len(COLOR_LIST)]
                 container_index += 1
 
-    # Find start and end times.
-    start_time = 1e10
-    end_time = 0.0
+    # Find start and end times (ns).
+    bounds = []
     for cpu, cpustats in containerstats.iteritems():
         for container, stats in cpustats.container_stats.iteritems():
-            start_time_candidate = stats.intervals[0].start
-            if start_time_candidate < start_time:
-                start_time = start_time_candidate
-            end_time_candidate = stats.intervals[-1].start + stats.intervals[-1].duration
-            if end_time_candidate > end_time:
-                end_time = end_time_candidate
-
+            intervals = stats.intervals.values
+            if len(intervals):
+                bounds.append(intervals['start'].min())
+                bounds.append((intervals['start'] + intervals['duration']).max())
+    for link, stats in linkstats.iteritems():
+        for times in (stats.enqueues.values, stats.dequeues.values):
+            if len(times):
+                bounds.extend([times.min(), times.max()])
+    if not bounds:
+        print "WARNING: no scheduling data, not generating figure %s." % outfile
+        return
+    t0, t1 = int(min(bounds)), int(max(bounds))
+    start_time, end_time = seconds(t0), seconds(t1)
     elapsed = end_time - start_time
     print "Start: %0.2f, end: %0.2f, length: %0.4f" % (start_time, end_time, elapsed)
 
-    # Plot a history of scheduling events, with one row per CPU.
-    fig = plt.figure(figsize=(max(8, WIDTH_SCALE_FACTOR * elapsed), 8))
-    ax = fig.add_subplot(111)
+    # Bin the history at the finest zoom level.
+    levels = max(0, args.history_levels)
+    fig_width = min(max(8, WIDTH_SCALE_FACTOR * elapsed), HISTORY_MAX_WIDTH)
+    ncols = int(fig_width * HISTORY_DPI)
+    nbins = ncols << levels
+    width = max(1, -(-(t1 - t0 + 1) // nbins))  # ns per bin, rounded up
+
+    # Each row is drawn as two half-rows: a CPU fills both; a link has
+    # dequeues in the bottom half and enqueues in the top.  Pixels are
+    # white, darkened by the occupancy of each color.
+    numcpus = len(containerstats)
+    numlinks = len(linkstats)
+    shade = np.zeros((2 * (numcpus + numlinks), nbins, 3))
     for i, cpu in enumerate(sorted(containerstats.keys())):
         cpustats = containerstats[cpu]
         for container, stats in cpustats.container_stats.iteritems():
-            bars = [(d.start, d.duration) for d in stats.intervals]
-            ax.broken_barh(bars, (0.5 + i, 1), facecolors = colors[container],
-                           label = container, linewidth = 0)
+            intervals = stats.intervals.values
+            occ = occupancy(intervals['start'],
+                            intervals['start'] + intervals['duration'],
+                            t0, width, nbins)
+            rgb = np.asarray(m.colors.to_rgb(colors[container]))
+            shade[2 * i:2 * i + 2] += occ[:, None] * (1 - rgb)
 
     # Add dq/enq operations to history
-    numcpus = len(containerstats)
-    numlinks = len(linkstats)
     row_index = numcpus
-    Q_COLOR = '#000000'
     # Keep this small to show fine detail, but large enough to show up
     # at reasonable resolutions on limited displays.
-    DELTA = 5e-5 
+    DELTA = to_ns(5e-5)
     for i, link in enumerate(sorted(linkstats.keys())):
         stats = linkstats[link]
-        # Enqueues on top, Dequeues on bottom.
-        bars = [(d, DELTA) for d in stats.enqueues]
-        ax.broken_barh(bars, (1.0 + row_index, 0.5),
-                       facecolors = Q_COLOR, label = 'enqueues', linewidth = 0)
-        bars = [(d, DELTA) for d in stats.dequeues]
-        ax.broken_barh(bars, (0.5 + row_index, 0.5),
-                       facecolors = Q_COLOR, label = 'dequeues', linewidth = 0)
+        for half, times in enumerate((stats.dequeues.values,
+                                      stats.enqueues.values)):
+            occ = occupancy(times, times + DELTA, t0, width, nbins)
+            shade[2 * row_index + half] += occ[:, None]
         row_index += 1
-
-    ax.set_ylim(0, numcpus + numlinks)
-    #ax.set_xlim(0,200)
-    ax.set_xlabel('seconds')
-    ax.set_yticks([1 + i for i in range(numcpus + numlinks)])
-    yticklabels = (['CPU %i' % (1 + i) for i in range(numcpus)] + 
-                   ['Link %s' % s for s in sorted(linkstats.keys())])
-    ax.set_yticklabels(yticklabels)
-
-    # TODO: make this work.
-    #plt.legend( [c for c in colors.keys()], loc='right')
+    image = 1 - np.clip(shade, 0, 1)
+    del shade
 
     if title is None:
         title = outfile
-    plt.title(title)
-
-    for ext in exts:
-        print outfile + ' ' + ext
-        plt.savefig(outfile + '.' + ext)
-    if args.show:
-        plt.show()
+    for level in xrange(levels + 1):
+        ntiles = 1 << level
+        # Average the finest bins down to ncols columns per tile.
+        scale = 1 << (levels - level)
+        tiles = image.reshape(len(image), ntiles, ncols, scale, 3).mean(axis=3)
+        tile_sec = seconds(ncols * scale * width)
+        for tile in xrange(ntiles):
+            begin = start_time + tile * tile_sec
+            fig = plt.figure(figsize=(fig_width, 8), dpi=HISTORY_DPI)
+            ax = fig.add_subplot(111)
+            ax.imshow(tiles[:, tile], origin='lower', aspect='auto',
+                      interpolation='nearest',
+                      extent=(begin, begin + tile_sec,
+                              0.5, 0.5 + numcpus + numlinks))
+
+            ax.set_ylim(0, numcpus + numlinks)
+            ax.set_xlabel('seconds')
+            ax.set_yticks([1 + i for i in range(numcpus + numlinks)])
+            yticklabels = (['CPU %i' % (1 + i) for i in range(numcpus)] +
+                           ['Link %s' % s for s in sorted(linkstats.keys())])
+            ax.set_yticklabels(yticklabels)
+
+            # TODO: make this work.
+            #plt.legend( [c for c in colors.keys()], loc='right')
+
+            name = outfile
+            if level:
+                name = '%s-z%d-%d' % (outfile, level, tile)
+            plt.title(title if not level else '%s (%dx, %d/%d)' % (title, ntiles, tile + 1, ntiles))
+            for ext in exts:
+                print name + ' ' + ext
+                plt.savefig(name + '.' + ext)
+            if args.show:
+                plt.show()
+            plt.close(fig)
 
 def plot(containerstats, linkstats):
     dir = args.odir
@@ -765,6 +1925,9 @@ def plot(containerstats, linkstats):
                               prop='inter_dequeues',
                               title="History of inter-dequeue times",
                               window_sec=args.window_sec)
+
+    if 'qlen' in args.plots:
+        save_link_qlen(linkstats, window_sec=args.window_sec)
     return
 
 containerstats, linkstats = parse(args.file, args)
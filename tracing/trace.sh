@@ -87,3 +87,15 @@ trace_plot() {
 	traceoutput=$mntrace
 	python $parse -f $traceoutput --odir $(dirname $traceoutput)/plots
 }
+
+
+trace_watch() {
+	# argument: path of the trace being written by trace_start
+	# Prints a rolling summary of the trace as it is written; stop it
+	# with Ctrl-C, after which it plots what it has seen.
+	this_script_loc="${BASH_SOURCE[0]}"
+	this_script_dir="${this_script_loc%/*}"
+	parse=$this_script_dir/parse.py
+	traceoutput=${1-/tmp/mntrace}
+	python $parse -f $traceoutput --follow --odir $(dirname $traceoutput)/plots
+}
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+"""
+Check the qdisc and /proc/net/dev decoders against the recorded
+fixtures in fixtures/, without root or a Mininet network:
+
+    fixtures/qdisc-dump.hex   one rtnetlink qdisc dump, recorded with
+                              qdisc.RecordingBackend (lo: noqueue; ifb0:
+                              htb 1: with pfifo 10: under class 1:1;
+                              eth0: pfifo_fast)
+    fixtures/net-dev.txt      a /proc/net/dev, with counters past 2^32,
+                              a name that is a prefix of another
+                              (s0-eth1, s0-eth10), and a row with no space
+                              after the colon
+
+Usage: ./check-fixtures.py
+"""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from qdisc import QdiscSampler, ReplayBackend
+from netdev import ProcNetDev
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+failed = 0
+
+def check(what, got, expected):
+    global failed
+    if got != expected:
+        print 'FAILED: %s: got %r, expected %r' % (what, got, expected)
+        failed += 1
+
+def check_qdisc():
+    backend = ReplayBackend.load(os.path.join(FIXTURES, 'qdisc-dump.hex'))
+    sampler = QdiscSampler(backend)
+    qdiscs = sampler.sample()
+    check('qdisc kinds', [(q.ifindex, q.kind, q.handle >> 16, q.parent)
+                          for q in qdiscs],
+          [(1, 'noqueue', 0, 0xffffffff), (2, 'htb', 1, 0xffffffff),
+           (2, 'pfifo', 0x10, 0x10001), (4, 'pfifo_fast', 0, 0xffffffff)])
+    check('pfifo_fast counters', (qdiscs[-1].bytes, qdiscs[-1].packets),
+          (149430, 1909))
+    # The replayed replies carry this request's sequence number, so a
+    # second sample is not mistaken for a stale reply; it then runs out.
+    check('only ifb0', [q.kind for q in QdiscSampler(
+        ReplayBackend.load(os.path.join(FIXTURES, 'qdisc-dump.hex'))).sample([2])],
+          ['htb', 'pfifo'])
+    try:
+        sampler.sample()
+        check('end of recording', 'sampled', 'StopIteration')
+    except StopIteration:
+        pass
+    sampler.close()
+
+def check_netdev():
+    # Read a copy, so that it can be rewritten under the open reader.
+    tmp = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmp, 'dev')
+        lines = open(os.path.join(FIXTURES, 'net-dev.txt')).read().split('\n')
+        open(fname, 'w').write('\n'.join(lines))
+        dev = ProcNetDev(fname)
+        stats = dev.read(['s0-eth1', 's0-eth10', 's0-eth2'])
+        check('s0-eth1', (stats['s0-eth1'].rx_bytes, stats['s0-eth1'].rx_drop,
+                          stats['s0-eth1'].tx_bytes),
+              (7865432198765, 12, 12345678901))
+        check('s0-eth10', (stats['s0-eth10'].tx_bytes,
+                           stats['s0-eth10'].tx_drop), (3000, 1))
+        check('s0-eth2', (stats['s0-eth2'].rx_bytes,
+                          stats['s0-eth2'].rx_multicast,
+                          stats['s0-eth2'].tx_packets), (98765432, 3, 42))
+        check('ifaces', sorted(dev.ifaces()),
+              ['eth0', 'lo', 's0-eth1', 's0-eth10', 's0-eth2'])
+        switch = re.compile('^s0-')
+        check('matching', sorted(dev.read_matching(switch)),
+              ['s0-eth1', 's0-eth10', 's0-eth2'])
+
+        # Interfaces come and go: the rows move under the reader.
+        header, rows = lines[:2], [l for l in lines[2:] if l]
+        rows = [l for l in reversed(rows) if not l.startswith('s0-eth10')]
+        open(fname, 'w').write('\n'.join(header + rows) + '\n')
+        stats = dev.read(['s0-eth1', 'lo'])
+        check('moved s0-eth1', stats['s0-eth1'].rx_packets, 5243621)
+        check('moved lo', stats['lo'].tx_bytes, 319950440)
+        check('matching after', sorted(dev.read_matching(switch)),
+              ['s0-eth1', 's0-eth2'])
+        try:
+            dev.read(['s0-eth10'])
+            check('gone s0-eth10', 'read', 'exception')
+        except Exception:
+            pass
+        dev.close()
+    finally:
+        shutil.rmtree(tmp)
+
+def main():
+    check_qdisc()
+    check_netdev()
+    if not failed:
+        print 'OK'
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+'''
+A monotonic clock for Python 2, which has no time.monotonic(): calls
+clock_gettime(CLOCK_MONOTONIC) through ctypes.  Unlike time.time(), it
+never steps when the wall clock is adjusted, so it is safe to compute
+deadlines and elapsed times with.
+'''
+
+import ctypes
+import ctypes.util
+import os
+import time
+
+CLOCK_MONOTONIC = 1  # Linux
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long),
+                ('tv_nsec', ctypes.c_long)]
+
+def clock_gettime_monotonic():
+    libc = ctypes.CDLL(ctypes.util.find_library('rt') or
+                       ctypes.util.find_library('c'), use_errno=True)
+    clock_gettime = libc.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    ts = timespec()
+    ref = ctypes.byref(ts)
+
+    def monotonic():
+        """Seconds (float) since some fixed, unspecified point."""
+        if clock_gettime(CLOCK_MONOTONIC, ref):
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+else:
+    monotonic = clock_gettime_monotonic()
@@ -0,0 +1,90 @@
+'''
+CPU time counters, read straight from the kernel: per-cgroup (i.e.,
+per-host, for CPULimitedHosts) from cgroupfs, and per-CPU from
+/proc/stat.  All times are in ns.
+
+Both cgroup layouts are understood:
+
+    v1: ROOT/cpuacct/NAME/cpuacct.usage       total ns
+        ROOT/cpuacct/NAME/cpuacct.stat        user, system in USER_HZ ticks
+    v2: ROOT/NAME/cpu.stat                    usage_usec, user_usec, system_usec
+
+ROOT is /sys/fs/cgroup by default; any directory laid out the same way
+(e.g. a fake tree for testing) will do, as will any file in the format
+of /proc/stat.
+'''
+
+import io
+import os
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+NSEC_PER_TICK = 10**9 // os.sysconf('SC_CLK_TCK')
+
+class Counter:
+    """A file kept open, and reread from the start on each read()."""
+    def __init__(self, fname):
+        self.f = io.FileIO(fname, 'r')
+
+    def read(self):
+        self.f.seek(0)
+        return self.f.readall()
+
+    def close(self):
+        self.f.close()
+
+def keyvals(text):
+    ret = {}
+    for line in text.split('\n'):
+        kv = line.split()
+        if len(kv) == 2:
+            ret[kv[0]] = int(kv[1])
+    return ret
+
+class CgroupCPU:
+    """CPU time used by the tasks in cgroup @name."""
+    def __init__(self, name, root=CGROUP_ROOT):
+        self.name = name
+        if os.path.exists(os.path.join(root, 'cgroup.controllers')):
+            self.v2 = True
+            self.stat = Counter(os.path.join(root, name, 'cpu.stat'))
+        else:
+            self.v2 = False
+            path = os.path.join(root, 'cpuacct', name)
+            self.usage = Counter(os.path.join(path, 'cpuacct.usage'))
+            self.stat = Counter(os.path.join(path, 'cpuacct.stat'))
+
+    def read(self):
+        """Returns (usage, user, system) CPU time in ns."""
+        stat = keyvals(self.stat.read())
+        if self.v2:
+            return (stat['usage_usec'] * 1000, stat['user_usec'] * 1000,
+                    stat['system_usec'] * 1000)
+        return (int(self.usage.read()), stat['user'] * NSEC_PER_TICK,
+                stat['system'] * NSEC_PER_TICK)
+
+    def close(self):
+        self.stat.close()
+        if not self.v2:
+            self.usage.close()
+
+# Columns of the cpuN lines in /proc/stat.
+PROC_STAT_FIELDS = ['user', 'nice', 'system', 'idle', 'iowait', 'irq',
+                    'softirq', 'steal']
+
+class ProcStat:
+    """Per-CPU time counters from /proc/stat."""
+    def __init__(self, fname='/proc/stat'):
+        self.counter = Counter(fname)
+
+    def read(self):
+        """Returns a list, by CPU, of lists of the PROC_STAT_FIELDS
+        times (in ns)."""
+        ret = []
+        for line in self.counter.read().split('\n'):
+            if line.startswith('cpu') and line[3:4].isdigit():
+                values = [int(v) * NSEC_PER_TICK for v in line.split()[1:9]]
+                ret.append(values + [0] * (8 - len(values)))
+        return ret
+
+    def close(self):
+        self.counter.close()
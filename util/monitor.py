@@ -1,88 +1,548 @@
-from time import sleep, time
+from time import time
 from subprocess import *
+from collections import defaultdict
+from multiprocessing import Process
+from select import select
+from threading import Thread
+import heapq
+import os
 import re
+import types
+from clock import monotonic
+from cpuacct import CGROUP_ROOT, CgroupCPU, ProcStat
+from netdev import ProcNetDev
+from qdisc import QdiscSampler, ifindex
+from sink import SampleSink, install_handlers
 
 default_dir = '.'
 
-def monitor_qlen(iface, interval_sec = 0.01, fname='%s/qlen.txt' % default_dir):
-    pat_queued = re.compile(r'backlog\s[^\s]+\s([\d]+)p')
-    cmd = "tc -s qdisc show dev %s" % (iface)
+QLEN_FIELDS = [('time', 'd'), ('qlen', 'I')]
+
+class Probe:
+    """Something a MonitorScheduler runs.  start() and close() are called
+    in the monitor process when it starts and stops; if @interval (in
+    seconds) is not None, sample() is called every @interval in
+    between, with the (wall clock) time at which it was called.  Probes
+    that report rates should measure the time between their samples
+    with clock.monotonic(), rather than assume it is @interval.
+
+    A sample() that has to wait for I/O, such as the output of a
+    command, can be a generator: each time it yields a file, it is
+    suspended until that file is readable, and the other probes run in
+    the meantime."""
+    name = 'probe'
+    interval = None
+
+    def start(self):
+        pass
+
+    def sample(self, now):
+        pass
+
+    def close(self):
+        pass
+
+class QlenProbe(Probe):
+    """Logs the queue length of each of @ifaces to fnames[iface] (by
+    default qlen_IFACE.txt), as time,packets records.  The queue length
+    is the backlog of the second qdisc on the interface, as `tc -s
+    qdisc show` lists them (i.e., the first one below the root).  All
+    the interfaces are sampled with one rtnetlink dump, over a socket
+    that stays open; @backend is passed to QdiscSampler.  @format is
+    that of the SampleSink for each file."""
+    name = 'qlen'
+
+    def __init__(self, ifaces, interval=0.01, fnames=None, backend=None,
+                 format='csv'):
+        if fnames is None:
+            fnames = dict((iface, '%s/qlen_%s.txt' % (default_dir, iface))
+                          for iface in ifaces)
+        self.ifaces = ifaces
+        self.interval = interval
+        self.fnames = fnames
+        self.backend = backend
+        self.format = format
+
+    def start(self):
+        self.sampler = QdiscSampler(self.backend)
+        self.indexes = dict((ifindex(iface), iface) for iface in self.ifaces)
+        self.sinks = dict((iface, SampleSink(self.fnames[iface], QLEN_FIELDS,
+                                             self.format))
+                          for iface in self.ifaces)
+
+    def sample(self, now):
+        qdiscs = defaultdict(list)
+        for q in self.sampler.sample(self.indexes):
+            qdiscs[q.ifindex].append(q)
+        for index, iface in self.indexes.iteritems():
+            if len(qdiscs[index]) > 1:
+                self.sinks[iface].write(now, qdiscs[index][1].qlen)
+
+    def close(self):
+        for sink in self.sinks.itervalues():
+            sink.close()
+        self.sampler.close()
+
+COUNT_FIELDS = [('time', 'd'), ('name', '16s'), ('packets', 'Q'),
+                ('bytes', 'Q')]
+
+def iptables(args, table='filter'):
+    return Popen("iptables -t %s %s" % (table, args), shell=True,
+                 stderr=PIPE).wait()
+
+def parse_counters(saved, rule_chain):
+    """Returns the [packets:bytes] counters of the rules of @rule_chain,
+    in order, from @saved, the output of iptables-save -c."""
+    prefix = ' -A %s ' % rule_chain
     ret = []
-    open(fname, 'w').write('')
-    while 1:
-        p = Popen(cmd, shell=True, stdout=PIPE)
-        output = p.stdout.read()
-        # Not quite right, but will do for now
-        matches = pat_queued.findall(output)
-        if matches and len(matches) > 1:
-            ret.append(matches[1])
-            t = "%f" % time()
-            open(fname, 'a').write(t + ',' + matches[1] + '\n')
-        sleep(interval_sec)
-    #open('qlen.txt', 'w').write('\n'.join(ret))
-    return
-
-def monitor_count(ipt_args="--src 10.0.0.0/8",
-                  interval_sec=0.01, fname='%s/bytes_sent.txt'
-                  % default_dir, chain="OUTPUT"):
-    cmd = "iptables -I %(chain)s 1 %(filter)s -j RETURN" % {
-        "filter": ipt_args,
-        "chain": chain,
-        }
-    # We always erase the first rule; will fix this later
-    Popen("iptables -D %s 1" % chain, shell=True).wait()
-    # Add our rule
-    Popen(cmd, shell=True).wait()
-    open(fname, 'w').write('')
-    cmd = "iptables -vnL %s 1 -Z" % (chain)
-    while 1:
-        p = Popen(cmd, shell=True, stdout=PIPE)
-        output = p.stdout.read().strip()
-        values = output.split(' ')
-        if len(values) > 2:
-            t = "%f" % time()
-            pkts, bytes = values[0], values[1]
-            open(fname, 'a').write(','.join([t, pkts, bytes]) + '\n')
-        sleep(interval_sec)
-    return
+    for line in saved.split('\n'):
+        # A rule with no match arguments has nothing after the chain.
+        if line.startswith('[') and prefix in line + ' ':
+            pkts, bytes = line[1:line.index(']')].split(':')
+            ret.append((int(pkts), int(bytes)))
+    return ret
 
-def monitor_devs(dev_pattern='^s', fname="%s/bytes_sent.txt" %
-                 default_dir, interval_sec=0.01):
+class CountProbe(Probe):
+    """Logs the packets and bytes matched by each of a set of iptables
+    filters since the previous sample, as time,name,packets,bytes
+    records.  @filters is a list of (name, iptables match arguments)
+    pairs, or a dict of them, or just the arguments of a single filter
+    (named 'count').
+
+    The filters are rules with no target in a chain of their own,
+    @rule_chain, which is jumped to from the top of @chain; no other
+    rules are touched.  A packet goes through every rule of the chain,
+    so it is counted by each filter it matches, even if the filters
+    overlap, and then returns to @chain.  Each sample reads the counters of all of them with one
+    iptables-save -c, and takes the difference from the previous sample,
+    so counters are never zeroed."""
+    name = 'count'
 
+    def __init__(self, filters="--src 10.0.0.0/8", interval=0.01,
+                 fname='%s/bytes_sent.txt' % default_dir, chain="OUTPUT",
+                 format='csv', rule_chain='mn_count', table='filter'):
+        if isinstance(filters, str):
+            filters = [('count', filters)]
+        elif isinstance(filters, dict):
+            filters = sorted(filters.items())
+        self.filters = filters
+        self.interval = interval
+        self.fname = fname
+        self.chain = chain
+        self.format = format
+        self.rule_chain = rule_chain
+        self.table = table
+
+    def remove_rules(self):
+        while iptables("-D %s -j %s" % (self.chain, self.rule_chain),
+                       self.table) == 0:
+            pass
+        iptables("-F %s" % self.rule_chain, self.table)
+        iptables("-X %s" % self.rule_chain, self.table)
+
+    def read(self):
+        p = Popen(["iptables-save", "-c", "-t", self.table], stdout=PIPE)
+        saved = p.stdout.read()
+        p.wait()
+        return parse_counters(saved, self.rule_chain)
+
+    def read_async(self):
+        """Like read(), as a generator that yields while iptables-save
+        runs, and leaves the counters in self.counters."""
+        p = Popen(["iptables-save", "-c", "-t", self.table], stdout=PIPE)
+        chunks = []
+        while True:
+            yield p.stdout
+            data = os.read(p.stdout.fileno(), 1 << 16)
+            if not data:
+                break
+            chunks.append(data)
+        p.stdout.close()
+        p.wait()
+        self.counters = parse_counters(''.join(chunks), self.rule_chain)
+
+    def start(self):
+        # Left over from a run that did not clean up?
+        self.remove_rules()
+        iptables("-N %s" % self.rule_chain, self.table)
+        for _, ipt_args in self.filters:
+            iptables("-A %s %s" % (self.rule_chain, ipt_args),
+                     self.table)
+        iptables("-I %s 1 -j %s" % (self.chain, self.rule_chain), self.table)
+        self.sink = SampleSink(self.fname, COUNT_FIELDS, self.format,
+                               schema=True)
+        self.prev = self.read()
+
+    def sample(self, now):
+        for f in self.read_async():
+            yield f
+        counters = self.counters
+        if len(counters) != len(self.filters):
+            return
+        for (name, _), (pkts, bytes), (prev_pkts, prev_bytes) in \
+                zip(self.filters, counters, self.prev):
+            self.sink.write(now, name, pkts - prev_pkts, bytes - prev_bytes)
+        self.prev = counters
+
+    def close(self):
+        self.sink.close()
+        self.remove_rules()
+
+class DevProbe(Probe):
     """Aggregates (sums) all txed bytes and rate (in Mbps) from
-       devices whose name matches @dev_pattern and writes to @fname"""
-    pat = re.compile(dev_pattern)
-    spaces = re.compile('\s+')
-    open(fname, 'w').write('')
-    prev_tx = {}
-    while 1:
-        lines = open('/proc/net/dev').read().split('\n')
-        t = str(time())
+       devices whose name matches @dev_pattern and writes to @fname,
+       as time,mbps,bytes,elapsed records, where elapsed is the
+       measured time (s) since the previous sample, over which the
+       rate is computed."""
+    name = 'devs'
+
+    def __init__(self, dev_pattern='^s', fname="%s/bytes_sent.txt" %
+                 default_dir, interval=0.01, format='csv'):
+        self.pat = re.compile(dev_pattern)
+        self.fname = fname
+        self.interval = interval
+        self.format = format
+
+    def start(self):
+        self.netdev = ProcNetDev()
+        self.sink = SampleSink(self.fname, [('time', 'd'), ('mbps', 'd'),
+                                            ('bytes', 'Q'), ('elapsed', 'd')],
+                               self.format)
+        self.prev_tx = {}
+        self.prev_read = monotonic()
+
+    def sample(self, now):
+        stats = self.netdev.read_matching(self.pat)
+        read = monotonic()
+        elapsed = read - self.prev_read
+        self.prev_read = read
         total = 0
-        for line in lines:
-            line = spaces.split(line.strip())
-            iface = line[0]
-            if pat.match(iface) and len(line) > 9:
-                tx_bytes = int(line[9])
-                total += tx_bytes - prev_tx.get(iface, tx_bytes)
-                prev_tx[iface] = tx_bytes
-        open(fname, 'a').write(','.join([t,
-             str(total * 8 / interval_sec / 1e6), str(total)]) + "\n")
-        sleep(interval_sec)
-    return
+        for iface, dev in stats.iteritems():
+            tx_bytes = dev.tx_bytes
+            total += tx_bytes - self.prev_tx.get(iface, tx_bytes)
+            self.prev_tx[iface] = tx_bytes
+        self.sink.write(now, total * 8 / elapsed / 1e6, total, elapsed)
+
+    def close(self):
+        self.sink.close()
+        self.netdev.close()
+
+RATE_FIELDS = [('time', 'd'), ('iface', '16s'), ('tx_bps', 'd'),
+               ('rx_bps', 'd'), ('tx_pps', 'd'), ('rx_pps', 'd'),
+               ('elapsed', 'd')]
+
+class RateProbe(Probe):
+    """Logs the transmit and receive rates of each interface whose name
+    matches @dev_pattern, in bits/s and packets/s, as RATE_FIELDS
+    records: one per interface per sample, over the measured time
+    elapsed (s) since the previous sample.  The counters are read from
+    /proc/net/dev; the output has a schema header, so plot_rate.py can
+    find the columns by name."""
+    name = 'rate'
+
+    def __init__(self, fname="%s/txrate.txt" % default_dir, interval=0.01,
+                 dev_pattern='.*', format='csv'):
+        self.fname = fname
+        self.interval = interval
+        self.pat = re.compile(dev_pattern)
+        self.format = format
+
+    def read(self):
+        stats = self.netdev.read_matching(self.pat)
+        return monotonic(), stats
+
+    def start(self):
+        self.netdev = ProcNetDev()
+        self.sink = SampleSink(self.fname, RATE_FIELDS, self.format,
+                               schema=True)
+        self.prev_read, self.prev = self.read()
+
+    def sample(self, now):
+        read, stats = self.read()
+        elapsed = read - self.prev_read
+        for iface in sorted(stats):
+            cur, prev = stats[iface], self.prev.get(iface)
+            if prev is None:
+                continue
+            self.sink.write(now, iface,
+                            (cur.tx_bytes - prev.tx_bytes) * 8 / elapsed,
+                            (cur.rx_bytes - prev.rx_bytes) * 8 / elapsed,
+                            (cur.tx_packets - prev.tx_packets) / elapsed,
+                            (cur.rx_packets - prev.rx_packets) / elapsed,
+                            elapsed)
+        self.prev_read, self.prev = read, stats
+
+    def close(self):
+        self.sink.close()
+        self.netdev.close()
+
+class CPUProbe(Probe):
+    """Logs the CPU usage of each processor over each @interval, read
+    from /proc/stat, in the format of top's per-CPU summary lines (one
+    line per CPU per sample), as helper.parse_cpu_usage expects:
+
+    Cpu0  :  0.0%us,  1.0%sy,  0.0%ni, 97.0%id,  0.0%wa,  0.0%hi,  2.0%si,  0.0%st
+    """
+    name = 'cpu'
+    # Columns of /proc/stat (user nice system idle iowait irq softirq
+    # steal) in the order top prints them.
+    ORDER = [0, 2, 1, 3, 4, 5, 6, 7]
+
+    def __init__(self, fname="%s/cpu.txt" % default_dir, interval=1.0):
+        self.fname = fname
+        self.interval = interval
+
+    def start(self):
+        self.f = open(self.fname, 'w')
+        self.stat = ProcStat()
+        self.prev = self.stat.read()
+
+    def sample(self, now):
+        cur = self.stat.read()
+        lines = []
+        for i, (a, b) in enumerate(zip(self.prev, cur)):
+            delta = [y - x for x, y in zip(a, b)]
+            total = sum(delta) or 1
+            lines.append('Cpu%-3d: %s\n' % (i, ', '.join(
+                '%5.1f%%%s' % (100.0 * delta[k] / total, label) for k, label in
+                zip(self.ORDER, ['us', 'sy', 'ni', 'id', 'wa', 'hi', 'si', 'st']))))
+        self.f.write(''.join(lines))
+        self.f.flush()
+        self.prev = cur
+
+    def close(self):
+        self.f.close()
+        self.stat.close()
+
+CPUACCT_FIELDS = [('time', 'd'), ('elapsed', 'd'), ('name', '16s'),
+                  ('usage', 'd'), ('user', 'd'), ('system', 'd')]
+
+class CPUAcctProbe(Probe):
+    """Logs CPU utilisation as time,elapsed,name,usage,user,system
+    records: usage, user and system are the CPU time used over the
+    elapsed time (s) since the previous sample, in CPUs (1.0 is one CPU
+    kept busy).  Each sample has a record for each cgroup in @cgroups
+    (e.g., the names of CPULimitedHosts), read from cgroupfs under
+    @root, and, if @percpu, one for each processor (named cpuN, and
+    read from @proc_stat), for which usage is the time not idle.  Both
+    cgroup v1 and v2 are understood; see util/cpuacct.py."""
+    name = 'cpuacct'
+
+    def __init__(self, cgroups=(), fname="%s/cpuacct.txt" % default_dir,
+                 interval=0.1, percpu=True, root=CGROUP_ROOT,
+                 proc_stat='/proc/stat', format='csv'):
+        self.cgroups = list(cgroups)
+        self.fname = fname
+        self.interval = interval
+        self.percpu = percpu
+        self.root = root
+        self.proc_stat = proc_stat
+        self.format = format
+
+    def read(self):
+        groups = [g.read() for g in self.groups]
+        cpus = self.stat.read() if self.percpu else []
+        return monotonic(), groups, cpus
+
+    def start(self):
+        self.sink = SampleSink(self.fname, CPUACCT_FIELDS, self.format)
+        self.groups = [CgroupCPU(name, self.root) for name in self.cgroups]
+        if self.percpu:
+            self.stat = ProcStat(self.proc_stat)
+        self.prev = self.read()
+
+    def sample(self, now):
+        cur = self.read()
+        elapsed = cur[0] - self.prev[0]
+        ns = elapsed * 1e9
+        for name, a, b in zip(self.cgroups, self.prev[1], cur[1]):
+            usage, user, system = [(y - x) / ns for x, y in zip(a, b)]
+            self.sink.write(now, elapsed, name, usage, user, system)
+        for i, (a, b) in enumerate(zip(self.prev[2], cur[2])):
+            user, nice, system, idle, iowait, irq, softirq, steal = \
+                [y - x for x, y in zip(a, b)]
+            total = float(sum([user, nice, system, idle, iowait, irq,
+                               softirq, steal]) or 1)
+            self.sink.write(now, elapsed, 'cpu%d' % i,
+                            (total - idle - iowait) / total,
+                            (user + nice) / total,
+                            (system + irq + softirq) / total)
+        self.prev = cur
+
+    def close(self):
+        self.sink.close()
+        for g in self.groups:
+            g.close()
+        if self.percpu:
+            self.stat.close()
+
+class MonitorScheduler:
+    """Runs a set of probes in one process: each periodic probe is
+    sampled at its own interval, from a heap of deadlines shared by
+    all of them, rather than each probe running its own sleep loop in
+    its own process.  Deadlines are kept on the probe's original
+    schedule, an absolute deadline on the monotonic clock, rather than
+    accumulating the time each sample takes.  A probe that falls behind
+    by a whole interval or more skips the deadlines it missed, rather
+    than sampling in a burst to catch up; the skipped samples are
+    counted.  So are deadlines that come while the probe's previous
+    sample is still waiting for I/O (see Probe).
+
+    How late each probe was sampled (its drift), and how many of its
+    deadlines were missed, is summarised in @drift_fname if given,
+    when the scheduler stops, one probe,samples,missed,mean_ms,max_ms
+    line per probe.
+
+        monitor = MonitorScheduler([CPUProbe('cpu.txt'),
+                                    QlenProbe(['s1-eth1'])])
+        monitor.start()
+        ...
+        monitor.stop()
+
+    start() runs the probes in a process of their own, or, with
+    thread=True, in a thread of the calling process.  stop() asks them
+    to stop, lets samples in progress finish (for up to @timeout
+    seconds), and closes the probes, which flushes their output.
+    """
+    def __init__(self, probes=(), drift_fname=None, timeout=1.0):
+        self.probes = list(probes)
+        self.drift_fname = drift_fname
+        self.timeout = timeout
+        self.process = None
+        self.stop_r, self.stop_w = os.pipe()
+
+    def add(self, probe):
+        self.probes.append(probe)
+
+    def resume(self, i, task, waiting, busy):
+        """Run @task, the sample() generator of probe @i, until it
+        next waits on a file, or finishes."""
+        try:
+            f = next(task)
+        except StopIteration:
+            busy.discard(i)
+            return
+        waiting[f.fileno()] = (i, task)
+        busy.add(i)
+
+    def run(self):
+        """Run the probes, in this process, until stop() or SIGTERM."""
+        install_handlers()
+        # samples, missed, total and max lateness, by probe
+        drift = dict((i, [0, 0, 0.0, 0.0]) for i in xrange(len(self.probes)))
+        started = []
+        waiting = {}  # fd => (probe, sample() generator) waiting on it
+        busy = set()  # probes with a sample in progress
+        try:
+            for probe in self.probes:
+                probe.start()
+                started.append(probe)
+            now = monotonic()
+            heap = [(now + probe.interval, i, probe)
+                    for i, probe in enumerate(self.probes)
+                    if probe.interval is not None]
+            heapq.heapify(heap)
+            while 1:
+                timeout = None
+                if heap:
+                    timeout = max(0.0, heap[0][0] - monotonic())
+                readable, _, _ = select(waiting.keys() + [self.stop_r],
+                                        [], [], timeout)
+                if self.stop_r in readable:
+                    break
+                for fd in readable:
+                    i, task = waiting.pop(fd)
+                    self.resume(i, task, waiting, busy)
+                now = monotonic()
+                while heap and heap[0][0] <= now:
+                    deadline, i, probe = heap[0]
+                    stats = drift[i]
+                    if i in busy:
+                        stats[1] += 1
+                    else:
+                        late = max(0.0, now - deadline)
+                        stats[0] += 1
+                        stats[2] += late
+                        stats[3] = max(stats[3], late)
+                        task = probe.sample(time())
+                        if isinstance(task, types.GeneratorType):
+                            self.resume(i, task, waiting, busy)
+                    deadline += probe.interval
+                    now = monotonic()
+                    if deadline <= now:
+                        missed = int((now - deadline) // probe.interval) + 1
+                        stats[1] += missed
+                        deadline += missed * probe.interval
+                    heapq.heapreplace(heap, (deadline, i, probe))
+            # Let the samples in progress finish.
+            end = monotonic() + self.timeout
+            while waiting and monotonic() < end:
+                readable, _, _ = select(waiting.keys(), [], [],
+                                        max(0.0, end - monotonic()))
+                for fd in readable:
+                    i, task = waiting.pop(fd)
+                    self.resume(i, task, waiting, busy)
+        finally:
+            for probe in started:
+                probe.close()
+            if self.drift_fname:
+                self.write_drift(drift)
+
+    def write_drift(self, drift):
+        f = open(self.drift_fname, 'w')
+        for i, probe in enumerate(self.probes):
+            n, missed, total, worst = drift[i]
+            if probe.interval is None:
+                continue
+            f.write('%s,%d,%d,%.3f,%.3f\n' % (probe.name, n, missed,
+                                              1e3 * total / max(n, 1),
+                                              1e3 * worst))
+        f.close()
+
+    def start(self, thread=False):
+        """Run the probes in a background process (or thread)."""
+        if thread:
+            self.process = Thread(target=self.run)
+            self.process.daemon = True
+        else:
+            self.process = Process(target=self.run)
+        self.process.start()
+
+    def stop(self):
+        os.write(self.stop_w, 'x')
+        self.process.join(self.timeout + 5)
+        if self.process.is_alive() and isinstance(self.process, Process):
+            self.process.terminate()
+            self.process.join()
+
+def monitor_qlen(iface, interval_sec = 0.01, fname='%s/qlen.txt' % default_dir,
+                 backend=None, format='csv'):
+    """Logs the queue length of @iface, as time,packets records."""
+    monitor_qdiscs([iface], interval_sec, {iface: fname}, backend, format)
+
+def monitor_qdiscs(ifaces, interval_sec=0.01, fnames=None, backend=None,
+                   format='csv'):
+    """See QlenProbe."""
+    MonitorScheduler([QlenProbe(ifaces, interval_sec, fnames, backend,
+                                format)]).run()
+
+def monitor_count(filters="--src 10.0.0.0/8",
+                  interval_sec=0.01, fname='%s/bytes_sent.txt'
+                  % default_dir, chain="OUTPUT", format='csv'):
+    """See CountProbe."""
+    MonitorScheduler([CountProbe(filters, interval_sec, fname, chain,
+                                 format)]).run()
+
+def monitor_devs(dev_pattern='^s', fname="%s/bytes_sent.txt" %
+                 default_dir, interval_sec=0.01, format='csv'):
+    """See DevProbe."""
+    MonitorScheduler([DevProbe(dev_pattern, fname, interval_sec,
+                               format)]).run()
 
 def monitor_devs_ng(fname="%s/txrate.txt" % default_dir, interval_sec=0.01):
-    """Uses bwm-ng tool to collect iface tx rate stats.  Very reliable."""
-    cmd = ("sleep 1; bwm-ng -t %s -o csv "
-           "-u bits -T rate -C ',' > %s" %
-           (interval_sec * 1000, fname))
-    Popen(cmd, shell=True).wait()
+    """See RateProbe.  (This once ran bwm-ng, hence the name.)"""
+    MonitorScheduler([RateProbe(fname, interval_sec)]).run()
 
 def monitor_cpu(fname="%s/cpu.txt" % default_dir):
-    cmd = "(top -b -p 1 -d 1 | grep --line-buffered \"^Cpu\") > %s" % fname
-    # BL: Disabling until we reinstantiate attachment using setns.
-    #if container is not None:
-    #    cmd = ("(top -b -p 1 -d 1 | "
-    #           "grep --line-buffered \\\"^Cpu\\\") > %s" % fname)
-    #    cmd = "lxc-execute -n %s -- bash -c \"%s\"" % (container, cmd)
-    Popen(cmd, shell=True).wait()
+    """See CPUProbe."""
+    MonitorScheduler([CPUProbe(fname)]).run()
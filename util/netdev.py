@@ -0,0 +1,110 @@
+'''
+Reads interface counters from /proc/net/dev:
+
+    Inter-|   Receive                                                |  Transmit
+     face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+        lo: 6175728   53444    0    0    0     0          0         0  6175728   53444    0    0    0     0       0          0
+
+The file is opened once, and each read rewinds it and reads it into the
+same buffer.  The row of each interface is remembered, so a read only
+splits and converts the rows it is asked for.  Any file in the same
+format, such as a saved copy, can stand in for /proc/net/dev.
+'''
+
+import io
+from collections import namedtuple
+
+NetDevStats = namedtuple('NetDevStats', [
+    'rx_bytes', 'rx_packets', 'rx_errs', 'rx_drop', 'rx_fifo', 'rx_frame',
+    'rx_compressed', 'rx_multicast',
+    'tx_bytes', 'tx_packets', 'tx_errs', 'tx_drop', 'tx_fifo', 'tx_colls',
+    'tx_carrier', 'tx_compressed'])
+
+HEADER_LINES = 2
+
+class ProcNetDev:
+    def __init__(self, fname='/proc/net/dev', bufsize=1 << 16):
+        self.fname = fname
+        self.f = io.FileIO(fname, 'r')
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.rows = {}  # iface name -> line number
+        self.lines = []
+        self.matches = {}  # pattern -> (number of lines, matching ifaces)
+
+    def refresh(self):
+        """Read the whole file again."""
+        self.f.seek(0)
+        n = 0
+        while True:
+            if n == len(self.buf):
+                buf = bytearray(2 * len(self.buf))
+                buf[:n] = self.buf
+                self.buf, self.view = buf, memoryview(buf)
+            got = self.f.readinto(self.view[n:])
+            if not got:
+                break
+            n += got
+        self.lines = self.view[:n].tobytes().split('\n')
+
+    def index(self):
+        self.rows = {}
+        for i in xrange(HEADER_LINES, len(self.lines)):
+            name = self.lines[i].split(':', 1)[0].strip()
+            if name:
+                self.rows[name] = i
+
+    def row(self, iface):
+        """The counters line of @iface in the last refresh()."""
+        i = self.rows.get(iface)
+        if i is None or i >= len(self.lines) or \
+                self.lines[i].split(':', 1)[0].strip() != iface:
+            # Interfaces have come or gone since we last looked.
+            self.index()
+            i = self.rows.get(iface)
+            if i is None:
+                raise Exception("could not find iface %s in %s" %
+                                (iface, self.fname))
+        return self.lines[i]
+
+    def read(self, ifaces=None):
+        """Returns a dict of NetDevStats for each of @ifaces (or for all
+        interfaces), read at the same time."""
+        self.refresh()
+        if ifaces is None:
+            self.index()
+            ifaces = self.rows.keys()
+        return self.parse(ifaces)
+
+    def read_matching(self, pat):
+        """Like read(), for the interfaces whose names match the
+        compiled regexp @pat.  Which interfaces those are is only
+        worked out again when interfaces come or go."""
+        self.refresh()
+        nlines, ifaces = self.matches.get(pat.pattern, (None, None))
+        if nlines == len(self.lines):
+            try:
+                return self.parse(ifaces)
+            except Exception:
+                pass  # One went and another came
+        self.index()
+        ifaces = [iface for iface in self.rows if pat.match(iface)]
+        self.matches[pat.pattern] = (len(self.lines), ifaces)
+        return self.parse(ifaces)
+
+    def parse(self, ifaces):
+        ret = {}
+        for iface in ifaces:
+            values = self.row(iface).split(':', 1)[1].split()
+            ret[iface] = NetDevStats(*map(int, values[:16]))
+        return ret
+
+    def ifaces(self):
+        """Names of all interfaces, as of the last read."""
+        if not self.rows:
+            self.refresh()
+            self.index()
+        return self.rows.keys()
+
+    def close(self):
+        self.f.close()
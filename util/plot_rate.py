@@ -1,4 +1,5 @@
 from helper import *
+from sink import read_fields, read_samples
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--files', '-f',
@@ -83,22 +84,27 @@ pat_iface = re.compile(args.pat_iface)
 to_plot=[]
 """Output of bwm-ng csv has the following columns:
 unix_timestamp;iface_name;bytes_out;bytes_in;bytes_total;packets_out;packets_in;packets_total;errors_out;errors_in
+Output of monitor.RateProbe names its columns (RATE_FIELDS) in its header.
 """
 
-if args.normalise and args.labels == []:
-    raise "Labels required if summarising/normalising."
-    sys.exit(-1)
-
-bw = map(lambda e: int(e.replace('M','')), args.labels)
-idx = 0
+def read_rates(f):
+    """Returns the time since the first sample (s) and the rate (Mbps)
+    of each interface in @f, as dicts of lists by interface name, and
+    whether @f is bwm-ng output (whose times are sample numbers)."""
+    times, rate = {}, {}
+    fields = read_fields(f)
+    if fields is not None:
+        iface, t = fields.index('iface'), fields.index('time')
+        column = fields.index('rx_bps' if args.rx else 'tx_bps')
+        samples = read_samples(f)
+        for row in samples:
+            ifname = row[iface]
+            if ifname not in ['eth0', 'lo']:
+                times.setdefault(ifname, []).append(row[t] - samples[0][t])
+                rate.setdefault(ifname, []).append(row[column] / 1e6)
+        return times, rate, False
 
-for f in args.files:
     data = read_list(f)
-    #xaxis = map(float, col(0, data))
-    #start_time = xaxis[0]
-    #xaxis = map(lambda x: x - start_time, xaxis)
-    #rate = map(float, col(2, data))
-    rate = {}
     column = 2
     if args.rx:
         column = 3
@@ -114,12 +120,28 @@ for f in args.files:
                 rate[ifname].append(float(row[column]) * 8.0 / (1 << 20))
             except:
                 break
+    for k in rate.keys():
+        times[k] = range(len(rate[k]))
+    return times, rate, True
+
+if args.normalise and args.labels == []:
+    raise "Labels required if summarising/normalising."
+    sys.exit(-1)
+
+bw = map(lambda e: int(e.replace('M','')), args.labels)
+idx = 0
+
+for f in args.files:
+    times, rate, bwm_ng = read_rates(f)
 
     if args.summarise:
         for k in rate.keys():
             if pat_iface.match(k):
                 print k
-                vals = filter(lambda e: e < 1500, rate[k][10:-10])
+                vals = rate[k][10:-10]
+                if bwm_ng:
+                    # Drop bwm-ng's occasional bogus spikes.
+                    vals = filter(lambda e: e < 1500, vals)
                 if args.normalise:
                     vals = map(lambda e: e / bw[idx], vals)
                     idx += 1
@@ -128,7 +150,7 @@ for f in args.files:
         for k in sorted(rate.keys()):
             if pat_iface.match(k):
                 print k
-                plt.plot(rate[k], label=k)
+                plt.plot(times[k], rate[k], label=k)
 
 plt.title("TX rates")
 if args.rx:
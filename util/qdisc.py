@@ -0,0 +1,217 @@
+'''
+Reads qdisc statistics (backlog, drops, overlimits) straight from the
+kernel over rtnetlink, the way `tc -s qdisc show` does, but without
+forking a shell and tc, and without parsing text, for each sample.
+
+    sampler = QdiscSampler()
+    for q in sampler.sample([ifindex('s1-eth1')]):
+        print q.kind, q.qlen, q.backlog, q.drops
+
+The socket is kept open across samples.  Where the replies come from is
+up to the backend: NetlinkBackend talks to the kernel; ReplayBackend
+plays back replies saved by RecordingBackend, so the parsing can be
+exercised without root, or a kernel with the right qdiscs.
+'''
+
+import os
+import socket
+import struct
+from collections import namedtuple
+
+NETLINK_ROUTE = 0
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWQDISC = 36
+RTM_GETQDISC = 38
+
+TCA_KIND = 1
+TCA_STATS = 3
+TCA_STATS2 = 7
+TCA_STATS_BASIC = 1
+TCA_STATS_QUEUE = 3
+
+NLMSG = struct.Struct('IHHII')  # len, type, flags, seq, pid
+TCMSG = struct.Struct('BBHiIII')  # family, pad, pad, ifindex, handle, parent, info
+RTATTR = struct.Struct('HH')  # len, type
+STATS_BASIC = struct.Struct('QI')  # bytes, packets
+STATS_QUEUE = struct.Struct('IIIII')  # qlen, backlog, drops, requeues, overlimits
+STATS_LEGACY = struct.Struct('QIIIIIII')  # bytes, packets, drops, overlimits,
+                                          # bps, pps, qlen, backlog
+
+QdiscStats = namedtuple('QdiscStats', ['ifindex', 'handle', 'parent', 'kind',
+                                       'bytes', 'packets', 'drops',
+                                       'overlimits', 'requeues',
+                                       'qlen', 'backlog'])
+
+def align(n):
+    return (n + 3) & ~3
+
+def ifindex(iface):
+    return int(open('/sys/class/net/%s/ifindex' % iface).read())
+
+class NetlinkBackend:
+    """An rtnetlink socket; request() sends a qdisc dump request, and
+    recv() returns the reply datagrams one at a time."""
+    def __init__(self, bufsize=1 << 16):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+
+    def request(self, seq):
+        msg = (NLMSG.pack(NLMSG.size + TCMSG.size, RTM_GETQDISC,
+                          NLM_F_REQUEST | NLM_F_DUMP, seq, 0) +
+               TCMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0))
+        self.sock.send(msg)
+
+    def recv(self):
+        n = self.sock.recv_into(self.buf)
+        return self.view[:n].tobytes()
+
+    def close(self):
+        self.sock.close()
+
+class RecordingBackend:
+    """Passes through to @backend, and saves the replies to each request
+    to @fname, one line of hex-encoded datagrams per request, for
+    ReplayBackend."""
+    def __init__(self, backend, fname):
+        self.backend = backend
+        self.f = open(fname, 'w')
+        self.first = True
+
+    def request(self, seq):
+        if not self.first:
+            self.f.write('\n')
+        self.first = False
+        self.backend.request(seq)
+
+    def recv(self):
+        data = self.backend.recv()
+        self.f.write(data.encode('hex') + ' ')
+        return data
+
+    def close(self):
+        self.f.write('\n')
+        self.f.close()
+        self.backend.close()
+
+class ReplayBackend:
+    """Plays back @replies, a list with one list of datagrams per
+    request, in order.  The recorded sequence numbers are rewritten to
+    those of the replayed requests."""
+    def __init__(self, replies):
+        self.replies = iter(replies)
+        self.pending = []
+        self.seq = 0
+
+    @classmethod
+    def load(cls, fname):
+        return cls([[d.decode('hex') for d in line.split()]
+                    for line in open(fname) if line.strip()])
+
+    def request(self, seq):
+        # Raises StopIteration once the recording is used up.
+        self.pending = list(next(self.replies))
+        self.seq = seq
+
+    def recv(self):
+        data = bytearray(self.pending.pop(0))
+        off = 0
+        while off + NLMSG.size <= len(data):
+            length = NLMSG.unpack_from(data, off)[0]
+            struct.pack_into('I', data, off + 8, self.seq)
+            off += align(max(length, NLMSG.size))
+        return bytes(data)
+
+    def close(self):
+        pass
+
+class QdiscSampler:
+    """Samples the stats of every qdisc (or of those on the given
+    interfaces) with one rtnetlink dump per sample."""
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = NetlinkBackend()
+        self.backend = backend
+        self.seq = 0
+
+    def sample(self, ifindexes=None):
+        """Return a list of QdiscStats, in the order tc would list them.
+        Only qdiscs on @ifindexes are decoded, if given."""
+        self.seq += 1
+        self.backend.request(self.seq)
+        ret = []
+        while True:
+            data = self.backend.recv()
+            if self.parse(data, ifindexes, ret):
+                return ret
+
+    def parse(self, data, ifindexes, ret):
+        """Append the qdiscs in datagram @data to @ret.  Returns True
+        once the end of the dump is reached."""
+        off = 0
+        while off + NLMSG.size <= len(data):
+            length, type, flags, seq, pid = NLMSG.unpack_from(data, off)
+            if length < NLMSG.size:
+                break
+            end = off + length
+            if seq != self.seq:
+                pass  # A stale reply to an earlier request.
+            elif type == NLMSG_DONE:
+                return True
+            elif type == NLMSG_ERROR:
+                err = -struct.unpack_from('i', data, off + NLMSG.size)[0]
+                if err:
+                    raise OSError(err, os.strerror(err))
+                return True
+            elif type == RTM_NEWQDISC:
+                q = self.parse_qdisc(data, off + NLMSG.size, end, ifindexes)
+                if q is not None:
+                    ret.append(q)
+            off += align(length)
+        return False
+
+    def parse_qdisc(self, data, off, end, ifindexes):
+        _, _, _, index, handle, parent, _ = TCMSG.unpack_from(data, off)
+        if ifindexes is not None and index not in ifindexes:
+            return None
+        kind = ''
+        basic = queue = legacy = None
+        for type, start, stop in attrs(data, off + TCMSG.size, end):
+            if type == TCA_KIND:
+                kind = str(data[start:stop]).rstrip('\0')
+            elif type == TCA_STATS2:
+                for type, start, stop in attrs(data, start, stop):
+                    if type == TCA_STATS_BASIC:
+                        basic = STATS_BASIC.unpack_from(data, start)
+                    elif type == TCA_STATS_QUEUE:
+                        queue = STATS_QUEUE.unpack_from(data, start)
+            elif type == TCA_STATS:
+                legacy = STATS_LEGACY.unpack_from(data, start)
+        if queue is not None:
+            bytes, packets = basic or (0, 0)
+            qlen, backlog, drops, requeues, overlimits = queue
+        elif legacy is not None:
+            bytes, packets, drops, overlimits, _, _, qlen, backlog = legacy
+            requeues = 0
+        else:
+            return None
+        return QdiscStats(index, handle, parent, kind, bytes, packets,
+                          drops, overlimits, requeues, qlen, backlog)
+
+    def close(self):
+        self.backend.close()
+
+def attrs(data, off, end):
+    """Yield (type, start, end) of each rtattr in data[off:end]."""
+    while off + RTATTR.size <= end:
+        length, type = RTATTR.unpack_from(data, off)
+        if length < RTATTR.size:
+            break
+        # The top bits of the type are flags (nested, byte order).
+        yield type & 0x3fff, off + RTATTR.size, off + length
+        off += align(length)
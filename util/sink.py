@@ -0,0 +1,152 @@
+'''
+Buffered output for the samplers in monitor.py.
+
+A SampleSink collects records in memory and writes them out in large
+writes, once it holds flush_bytes of output or flush_sec has passed,
+and when the process exits, including by SIGTERM (which is how
+multiprocessing's Process.terminate() stops a monitor).
+
+Records are written either as CSV lines, or as fixed-size binary
+records behind a one-line header that names the fields:
+
+    #sink {"fields": [["time", "d"], ["qlen", "i"]]}
+
+CSV files get the same header (with "format": "csv") if the sink is
+asked for a @schema, so that readers can find columns by name.
+read_samples() reads any of these back, and read_fields() the names.
+'''
+
+import atexit
+import json
+import signal
+import struct
+import sys
+import threading
+from time import time
+
+# By the last character of the struct code; everything else is an integer.
+CSV_FORMATS = {'d': '%f', 'f': '%f', 's': '%s'}
+BINARY_MAGIC = '#sink '
+
+# Sinks not yet closed in this process.
+open_sinks = []
+
+def close_all():
+    while open_sinks:
+        open_sinks[-1].close()
+
+def on_sigterm(signum, frame):
+    close_all()
+    sys.exit(0)
+
+def install_handlers():
+    if not install_handlers.done:
+        atexit.register(close_all)
+        install_handlers.done = True
+    # Only the main thread may set signal handlers; a monitor running
+    # in a thread of the experiment leaves its SIGTERM alone.
+    if not install_handlers.signals and \
+            isinstance(threading.current_thread(), threading._MainThread):
+        signal.signal(signal.SIGTERM, on_sigterm)
+        install_handlers.signals = True
+install_handlers.done = False
+install_handlers.signals = False
+
+class SampleSink:
+    """Writes records of @fields, a list of (name, struct code) pairs,
+    to @fname in @format 'csv' or 'binary'.  Binary files always start
+    with a header naming the fields; CSV files do if @schema."""
+    def __init__(self, fname, fields, format='csv',
+                 flush_bytes=1 << 16, flush_sec=1.0, schema=False):
+        if format not in ('csv', 'binary'):
+            raise ValueError("unknown sample format: %s" % format)
+        self.fname = fname
+        self.fields = fields
+        self.format = format
+        self.flush_bytes = flush_bytes
+        self.flush_sec = flush_sec
+        self.f = open(fname, 'wb')
+        if format == 'binary':
+            self.record = struct.Struct('<' + ''.join(c for _, c in fields))
+            self.f.write(BINARY_MAGIC + json.dumps({'fields': fields}) + '\n')
+        else:
+            self.line = ','.join(CSV_FORMATS.get(c[-1], '%d') for _, c in fields) + '\n'
+            if schema:
+                self.f.write(BINARY_MAGIC + json.dumps({'fields': fields,
+                                                        'format': 'csv'}) + '\n')
+        self.buf = []
+        self.size = 0
+        self.last_flush = time()
+        install_handlers()
+        open_sinks.append(self)
+
+    def write(self, *values):
+        if self.format == 'binary':
+            data = self.record.pack(*values)
+        else:
+            data = self.line % values
+        self.buf.append(data)
+        self.size += len(data)
+        if self.size >= self.flush_bytes or time() - self.last_flush >= self.flush_sec:
+            self.flush()
+
+    def flush(self):
+        if self.buf:
+            self.f.write(''.join(self.buf))
+            self.f.flush()
+            self.buf = []
+            self.size = 0
+        self.last_flush = time()
+
+    def close(self):
+        if self in open_sinks:
+            open_sinks.remove(self)
+            self.flush()
+            self.f.close()
+
+def csv_value(v):
+    for convert in (int, float):
+        try:
+            return convert(v)
+        except ValueError:
+            pass
+    return v
+
+def read_header(f):
+    """Returns the header of the sink file @f, or None if it has none
+    (in which case @f is left at the start)."""
+    header = f.readline()
+    if not header.startswith(BINARY_MAGIC):
+        f.seek(0)
+        return None
+    return json.loads(header[len(BINARY_MAGIC):])
+
+def read_fields(fname):
+    """Returns the names of the fields of the records in @fname, or None
+    if it is a CSV file without a schema."""
+    header = read_header(open(fname, 'rb'))
+    if header is None:
+        return None
+    return [name for name, _ in header['fields']]
+
+def read_samples(fname):
+    """Returns the records in @fname as a list of tuples."""
+    f = open(fname, 'rb')
+    header = read_header(f)
+    if header is None or header.get('format') == 'csv':
+        return [tuple(csv_value(v) for v in line.strip().split(','))
+                for line in f if line.strip()]
+    fields = header['fields']
+    record = struct.Struct('<' + ''.join(str(c) for _, c in fields))
+    strings = [i for i, (_, c) in enumerate(fields) if c.endswith('s')]
+    data = f.read()
+    n = len(data) // record.size
+    ret = [record.unpack_from(data, i * record.size) for i in xrange(n)]
+    if strings:
+        # Fixed-size strings are padded with NULs.
+        for i, r in enumerate(ret):
+            r = list(r)
+            for j in strings:
+                r[j] = r[j].rstrip('\0')
+            ret[i] = tuple(r)
+    return ret